@@ -0,0 +1,210 @@
+"""Shared cache backends that outlive a single process.
+
+The in-process caches in api/calendar.py are lost whenever a serverless
+instance starts cold. A backend configured through CACHE_BACKEND_URL keeps
+built feeds and refreshed OAuth tokens where the next instance can find
+them:
+
+    memory://                      in-process only (mainly for local runs)
+    sqlite:///tmp/ts_calendar.db   a SQLite file (sqlite://name.db is relative)
+    redis://[:password@]host:6379/0
+
+Values are bytes; every key carries its own TTL in seconds.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote, urlparse
+
+from api._cache import TTLCache
+
+
+class CacheBackend:
+    def get(self, key):
+        """Return the bytes stored under key, or None."""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self._cache = TTLCache(max_entries=max_entries, max_bytes=max_bytes)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl):
+        self._cache.set(key, value, ttl=ttl, size=len(value))
+
+    def delete(self, key):
+        self._cache.delete(key)
+
+
+class SQLiteBackend(CacheBackend):
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False,
+                                     isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at)"
+                " VALUES (?, ?, ?)",
+                (key, value, now + ttl),
+            )
+            self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+class RedisBackend(CacheBackend):
+    """Minimal RESP2 client covering GET, SET ... EX and DEL.
+
+    Speaks the protocol directly so any Redis-compatible server (or a local
+    stand-in) works without an extra dependency.
+    """
+
+    def __init__(self, host="localhost", port=6379, db=0, password=None,
+                 timeout=2):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port),
+                                              timeout=self.timeout)
+        self._file = self._sock.makefile("rb")
+        try:
+            if self.password:
+                self._call("AUTH", self.password)
+            if self.db:
+                self._call("SELECT", str(self.db))
+        except Exception:
+            # Don't leave an unauthenticated socket for the next call
+            self._close()
+            raise
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._file = None
+
+    def _call(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self._sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind in (b"+", b":"):
+            return rest
+        if kind == b"-":
+            raise RuntimeError(f"Redis error: {rest.decode()}")
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            return self._file.read(length + 2)[:-2]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def _execute(self, *args):
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._call(*args)
+                except (OSError, ConnectionError):
+                    # Reconnect once; the server may have dropped an idle socket
+                    self._close()
+                    if attempt == 2:
+                        raise
+
+    def get(self, key):
+        return self._execute("GET", key)
+
+    def set(self, key, value, ttl):
+        self._execute("SET", key, value, "EX", str(max(1, int(ttl))))
+
+    def delete(self, key):
+        self._execute("DEL", key)
+
+
+def backend_from_url(url):
+    """Create the backend described by url (see module docstring)."""
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return MemoryBackend()
+    if parsed.scheme == "sqlite":
+        # In sqlite://cache.db the file name parses as the host
+        return SQLiteBackend(parsed.netloc + parsed.path or ":memory:")
+    if parsed.scheme == "redis":
+        db = parsed.path.lstrip("/")
+        return RedisBackend(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            db=int(db) if db else 0,
+            password=unquote(parsed.password) if parsed.password else None,
+        )
+    raise ValueError(f"Unsupported cache backend URL: {url}")
+
+
+_backend = None
+_backend_loaded = False
+_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the process-wide backend from CACHE_BACKEND_URL, or None."""
+    global _backend, _backend_loaded
+    with _lock:
+        if not _backend_loaded:
+            url = os.environ.get("CACHE_BACKEND_URL", "")
+            _backend = backend_from_url(url) if url else None
+            _backend_loaded = True
+        return _backend
@@ -0,0 +1,61 @@
+from email.utils import parsedate_to_datetime
+
+
+def not_modified(headers, etag, last_modified=None):
+    """Check a request's If-None-Match / If-Modified-Since headers.
+
+    Returns True if the client's copy matches etag (weak comparison) or, when
+    no If-None-Match was sent, is at least as new as last_modified.
+    """
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match:
+        if if_none_match.strip() == "*":
+            return True
+        etag = etag.removeprefix("W/")
+        return any(tag.strip().removeprefix("W/") == etag
+                   for tag in if_none_match.split(","))
+
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return last_modified <= since
+    return False
+
+
+def preferred_encoding(headers, available=("gzip", "deflate")):
+    """Pick a content coding from available for the request's Accept-Encoding.
+
+    Returns the first of available (in order of preference) the client
+    accepts with a non-zero q-value, or None to send the identity coding.
+    """
+    accept = headers.get("Accept-Encoding")
+    if not accept:
+        return None
+    qvalues = {}
+    for part in accept.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        qvalues[coding.strip().lower()] = q
+    for coding in available:
+        if qvalues.get(coding, qvalues.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+def send_text(handler, status, text):
+    """Send a short text/plain response, with Content-Length for keep-alive."""
+    body = text.encode()
+    handler.send_response(status)
+    handler.send_header("Content-Type", "text/plain")
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
@@ -1,27 +1,321 @@
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
+from functools import lru_cache
 from zoneinfo import ZoneInfo
 
-from icalendar import Calendar, Event, Timezone, vText
+from api import _metrics
+
+PRODID = "-//ts-subscribe//TeamSnap Filtered Feed//EN"
+
+# TZIDs that icalendar writes as UTC ("...Z") rather than with a TZID param
+_UTC_TZIDS = frozenset([
+    "UTC", "Etc/UTC", "Etc/UCT", "UCT", "Etc/Universal", "Universal",
+    "Etc/Zulu", "Zulu",
+])
 
 
 def _parse_dt(value):
-    """Parse a TeamSnap datetime string into a timezone-aware datetime."""
+    """Parse a TeamSnap datetime string into a timezone-aware datetime.
+
+    Datetimes already parsed at ingest (see api._records) pass through.
+    """
+    if isinstance(value, datetime):
+        return value
     if not value:
         return None
     s = value.replace("Z", "+00:00")
     return datetime.fromisoformat(s)
 
 
+class _TeamTimezone:
+    """ZoneInfo, display label and VTIMEZONE blocks for one IANA zone."""
+
+    __slots__ = ("name", "zone", "label", "_vtimezones")
+
+    def __init__(self, name):
+        self.name = name
+        self.zone = ZoneInfo(name)
+        self.label = name.split("/")[-1].replace("_", " ")
+        self._vtimezones = {}
+
+    def vtimezone(self, first_year, last_year):
+        """Serialized VTIMEZONE with the real transitions for these years."""
+        key = (first_year, last_year)
+        block = self._vtimezones.get(key)
+        if block is None:
+            # Imported on first use; see generate_ical
+            from icalendar import Timezone
+
+            block = Timezone.from_tzid(
+                self.name,
+                first_date=date(first_year, 1, 1),
+                last_date=date(last_year, 12, 31),
+            ).to_ical()
+            self._vtimezones[key] = block
+        return block
+
+
+@lru_cache(maxsize=64)
+def _team_timezone(team_tz_name):
+    """Per-zone timezone data, built once per process."""
+    return _TeamTimezone(team_tz_name)
+
+
 def _format_arrival_time(dt, tz):
     """Format a datetime as a human-readable arrival time like TeamSnap does."""
-    local = dt.astimezone(tz)
+    local = dt.astimezone(tz.zone)
     time_str = local.strftime("%l:%M %p").strip()
-    tz_name = tz.key.split("/")[-1].replace("_", " ")
-    return f"{time_str} ({tz_name})"
+    return f"{time_str} ({tz.label})"
+
+
+def event_year_range(events, team_tz_name="UTC"):
+    """Return the (first, last) local calendar years spanned by events.
+
+    Used to limit the VTIMEZONE to the transitions a feed actually needs.
+    """
+    zone = _team_timezone(team_tz_name).zone
+    years = []
+    for ev in events:
+        for field in ("start_date", "end_date"):
+            dt = _parse_dt(ev.get(field))
+            if dt:
+                years.append(dt.astimezone(zone).year)
+    if not years:
+        year = datetime.now(zone).year
+        return year, year
+    return min(years), max(years)
+
+
+def _event_properties(ev, locations_by_id, opponents_by_id, team_name, tz,
+                      stable_dtstamp):
+    """Return the VEVENT properties for a TeamSnap event.
+
+    Properties are (name, value) pairs in the order icalendar serializes
+    them. Returns None if the event has no start time.
+    """
+    event_id = ev.get("id")
+    team_id = ev.get("team_id", "")
+    start = _parse_dt(ev.get("start_date"))
+    if not start:
+        return None
+
+    # Summary: "Team Name - Event" or "Team Name vs Opponent"
+    is_game = ev.get("is_game")
+    name = ev.get("name") or ""
+    if is_game:
+        opponent_id = ev.get("opponent_id")
+        if opponent_id and opponent_id in opponents_by_id:
+            opponent_name = opponents_by_id[opponent_id].get("name", "")
+            if opponent_name:
+                summary = f"{team_name} vs {opponent_name}"
+            elif name:
+                summary = f"{team_name} vs {name}"
+            else:
+                summary = f"{team_name} - Game Day"
+        elif name:
+            summary = f"{team_name} vs {name}"
+        else:
+            summary = f"{team_name} - Game Day"
+    else:
+        summary = f"{team_name} - {name or 'Event'}"
+
+    props = [("SUMMARY", summary)]
+
+    # Times in team timezone
+    props.append(("DTSTART", start.astimezone(tz.zone)))
+    end = _parse_dt(ev.get("end_date"))
+    if end:
+        props.append(("DTEND", end.astimezone(tz.zone)))
+
+    if stable_dtstamp:
+        dtstamp = (_parse_dt(ev.get("updated_at"))
+                   or _parse_dt(ev.get("created_at"))
+                   or start).astimezone(timezone.utc)
+    else:
+        dtstamp = datetime.now(timezone.utc)
+    props.append(("DTSTAMP", dtstamp))
+    props.append(("UID", f"{team_id}-{event_id}"))
+
+    # Location: address only (like TeamSnap)
+    location_id = ev.get("location_id")
+    loc_name = ""
+    loc_address = ""
+    if location_id and location_id in locations_by_id:
+        loc = locations_by_id[location_id]
+        loc_name = loc.get("name", "")
+        loc_address = loc.get("address", "")
+
+    # Description: "Location: Venue\n   (Arrival Time: HH:MM AM (TZ))"
+    desc_parts = []
+    if loc_name:
+        arrival_str = _format_arrival_time(start, tz)
+        desc_parts.append(f"Location: {loc_name}\n   (Arrival Time: {arrival_str})")
+    if ev.get("notes"):
+        desc_parts.append(ev["notes"])
+    if ev.get("is_canceled"):
+        desc_parts.append("** CANCELED **")
+    if desc_parts:
+        props.append(("DESCRIPTION", " ".join(desc_parts)))
+
+    if loc_address:
+        props.append(("LOCATION", loc_address))
+
+    if ev.get("is_canceled"):
+        props.append(("STATUS", "CANCELLED"))
+
+    return props
+
+
+def _escape_text(value):
+    """Escape a TEXT value per RFC 5545, the way icalendar does."""
+    return (
+        value.replace("\\N", "\n")
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+        .replace("\r", "\\n")
+    )
+
+
+def _unescape_newlines(text):
+    """Keep TeamSnap's literal \\n as an RFC 5545 newline.
+
+    Applied after folding, like the icalendar path's fix-up of to_ical(),
+    so both paths produce the same bytes.
+    """
+    return text.replace("\\\\n", "\\n")
+
+
+def _fold(line):
+    """Fold a content line to 75 octets, matching icalendar's folding."""
+    if len(line) < 75 and line.isascii():
+        return line
+
+    chunks = []
+    current = []
+    byte_count = 0
+    for char in line:
+        char_len = 1 if char < "\x80" else len(char.encode("utf-8"))
+        if current and byte_count + char_len >= 75:
+            # Don't split a backslash escape across the fold
+            if len(current) > 1 and current[-1] in "\\^":
+                carried = current.pop()
+                chunks.append("".join(current))
+                current = [carried]
+                byte_count = len(carried)
+            else:
+                chunks.append("".join(current))
+                current = []
+                byte_count = 0
+        current.append(char)
+        byte_count += char_len
+    if current:
+        chunks.append("".join(current))
+    return "\r\n ".join(chunks)
+
+
+def _format_datetime(name, dt):
+    stamp = (f"{dt.year:04d}{dt.month:02d}{dt.day:02d}"
+             f"T{dt.hour:02d}{dt.minute:02d}{dt.second:02d}")
+    tzid = getattr(dt.tzinfo, "key", None)
+    if tzid is None or tzid in _UTC_TZIDS:
+        return f"{name}:{stamp}Z"
+    return f"{name};TZID={tzid}:{stamp}"
+
+
+def _render_vevent(props):
+    """Serialize VEVENT properties straight to RFC 5545 bytes."""
+    lines = ["BEGIN:VEVENT"]
+    for name, value in props:
+        if isinstance(value, datetime):
+            lines.append(_format_datetime(name, value))
+        else:
+            lines.append(_fold(f"{name}:{_escape_text(value)}"))
+    lines.append("END:VEVENT\r\n")
+    return _unescape_newlines("\r\n".join(lines)).encode("utf-8")
+
+
+def render_event(ev, locations_by_id, opponents_by_id, team_name="TeamSnap",
+                 team_tz_name="UTC", stable_dtstamp=True):
+    """Render one TeamSnap event as a serialized VEVENT block.
+
+    Fragments depend only on the event and team-wide data, so they can be
+    rendered once per team and shared by every member feed via
+    render_calendar(). Returns None if the event has no start time.
+    """
+    props = _event_properties(ev, locations_by_id, opponents_by_id or {},
+                              team_name, _team_timezone(team_tz_name),
+                              stable_dtstamp)
+    if props is None:
+        return None
+    return _render_vevent(props)
+
+
+def _calendar_header(cal_name, team_tz_name):
+    header = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        _fold(f"X-WR-CALNAME:{_escape_text(cal_name)}"),
+        _fold(f"X-WR-TIMEZONE:{_escape_text(team_tz_name)}"),
+        "",
+    ]
+    return _unescape_newlines("\r\n".join(header)).encode("utf-8")
+
+
+def render_calendar(fragments, team_name="TeamSnap", team_tz_name="UTC",
+                    years=None):
+    """Wrap pre-rendered VEVENT fragments in a VCALENDAR.
+
+    years is the (first, last) range the VTIMEZONE covers; see
+    event_year_range(). Defaults to the current year.
+    """
+    tz = _team_timezone(team_tz_name)
+    if years is None:
+        year = datetime.now(tz.zone).year
+        years = (year, year)
+    return b"".join([
+        _calendar_header(f"{team_name} (Attending)", team_tz_name),
+        tz.vtimezone(*years),
+        *fragments,
+        b"END:VCALENDAR\r\n",
+    ])
+
+
+def render_merged_calendar(parts, cal_name="TeamSnap (Attending)"):
+    """Merge pre-rendered feeds for several teams into one VCALENDAR.
+
+    Args:
+        parts: List of (team_tz_name, years, fragments) tuples, one per team,
+            where years is the (first, last) range from event_year_range().
+        cal_name: X-WR-CALNAME of the merged calendar.
+
+    Returns:
+        bytes: The iCal data, with one VTIMEZONE per distinct team timezone.
+    """
+    zones = {}
+    for team_tz_name, years, _ in parts:
+        if team_tz_name in zones:
+            first, last = zones[team_tz_name]
+            years = (min(first, years[0]), max(last, years[1]))
+        zones[team_tz_name] = years
+
+    default_tz = parts[0][0] if parts else "UTC"
+    chunks = [_calendar_header(cal_name, default_tz)]
+    for team_tz_name, years in zones.items():
+        chunks.append(_team_timezone(team_tz_name).vtimezone(*years))
+    for _, _, fragments in parts:
+        chunks.extend(fragments)
+    chunks.append(b"END:VCALENDAR\r\n")
+    return b"".join(chunks)
 
 
 def generate_ical(events, locations_by_id, opponents_by_id=None,
-                  team_name="TeamSnap", team_tz_name="UTC"):
+                  team_name="TeamSnap", team_tz_name="UTC",
+                  stable_dtstamp=False, fast=False):
     """Generate an iCal VCALENDAR matching TeamSnap's native format.
 
     Args:
@@ -30,6 +324,12 @@ def generate_ical(events, locations_by_id, opponents_by_id=None,
         opponents_by_id: Dict mapping opponent_id to opponent dict.
         team_name: The team's display name.
         team_tz_name: IANA timezone name for the team (e.g. "Asia/Hong_Kong").
+        stable_dtstamp: Take DTSTAMP from the event's updated_at (falling back
+            to created_at, then its start) instead of the current time, so
+            identical inputs produce byte-identical output.
+        fast: Write RFC 5545 lines directly instead of building icalendar
+            objects. Output is the same apart from X-WR-CALNAME, which the
+            fast path escapes as TEXT.
 
     Returns:
         bytes: The iCal data.
@@ -37,88 +337,48 @@ def generate_ical(events, locations_by_id, opponents_by_id=None,
     if opponents_by_id is None:
         opponents_by_id = {}
 
-    tz = ZoneInfo(team_tz_name)
+    tz = _team_timezone(team_tz_name)
+    years = event_year_range(events, team_tz_name)
+
+    if fast:
+        fragments = []
+        with _metrics.span("ical_events"):
+            for ev in events:
+                props = _event_properties(ev, locations_by_id, opponents_by_id,
+                                          team_name, tz, stable_dtstamp)
+                if props is not None:
+                    fragments.append(_render_vevent(props))
+        with _metrics.span("ical_serialize"):
+            return render_calendar(fragments, team_name, team_tz_name, years)
+
+    # icalendar is slow to import, so cold starts that never build a feed
+    # (cache hits, bad requests) don't pay for it
+    from icalendar import Calendar, Event, Timezone
 
     cal = Calendar()
-    cal.add("prodid", "-//ts-subscribe//TeamSnap Filtered Feed//EN")
+    cal.add("prodid", PRODID)
     cal.add("version", "2.0")
     cal.add("calscale", "GREGORIAN")
     cal.add("method", "PUBLISH")
     cal.add("x-wr-calname", f"{team_name} (Attending)")
     cal.add("x-wr-timezone", team_tz_name)
 
-    # Add VTIMEZONE component
-    cal.add_component(Timezone.from_ical(
-        Timezone(TZID=team_tz_name).to_ical()
-    ))
+    # Add VTIMEZONE component with the transitions the events need
+    cal.add_component(Timezone.from_ical(tz.vtimezone(*years)))
 
-    for ev in events:
-        event_id = ev.get("id")
-        team_id = ev.get("team_id", "")
-        start = _parse_dt(ev.get("start_date"))
-        if not start:
-            continue
-
-        vevent = Event()
-        vevent.add("uid", f"{team_id}-{event_id}")
-
-        # Summary: "Team Name - Event" or "Team Name vs Opponent"
-        is_game = ev.get("is_game")
-        name = ev.get("name") or ""
-        if is_game:
-            opponent_id = ev.get("opponent_id")
-            if opponent_id and opponent_id in opponents_by_id:
-                opponent_name = opponents_by_id[opponent_id].get("name", "")
-                if opponent_name:
-                    vevent.add("summary", f"{team_name} vs {opponent_name}")
-                elif name:
-                    vevent.add("summary", f"{team_name} vs {name}")
-                else:
-                    vevent.add("summary", f"{team_name} - Game Day")
-            elif name:
-                vevent.add("summary", f"{team_name} vs {name}")
-            else:
-                vevent.add("summary", f"{team_name} - Game Day")
-        else:
-            vevent.add("summary", f"{team_name} - {name or 'Event'}")
-
-        # Times in team timezone
-        local_start = start.astimezone(tz)
-        vevent.add("dtstart", local_start)
-        end = _parse_dt(ev.get("end_date"))
-        if end:
-            local_end = end.astimezone(tz)
-            vevent.add("dtend", local_end)
-
-        # Location: address only (like TeamSnap)
-        location_id = ev.get("location_id")
-        loc_name = ""
-        if location_id and location_id in locations_by_id:
-            loc = locations_by_id[location_id]
-            loc_name = loc.get("name", "")
-            loc_address = loc.get("address", "")
-            if loc_address:
-                vevent.add("location", loc_address)
-
-        # Description: "Location: Venue\n   (Arrival Time: HH:MM AM (TZ))"
-        desc_parts = []
-        if loc_name:
-            arrival_str = _format_arrival_time(start, tz)
-            desc_parts.append(f"Location: {loc_name}\n   (Arrival Time: {arrival_str})")
-        if ev.get("notes"):
-            desc_parts.append(ev["notes"])
-        if ev.get("is_canceled"):
-            desc_parts.append("** CANCELED **")
-        if desc_parts:
-            vevent.add("description", " ".join(desc_parts))
-
-        if ev.get("is_canceled"):
-            vevent.add("status", "CANCELLED")
-
-        vevent.add("dtstamp", datetime.now(timezone.utc))
-
-        cal.add_component(vevent)
+    with _metrics.span("ical_events"):
+        for ev in events:
+            props = _event_properties(ev, locations_by_id, opponents_by_id,
+                                      team_name, tz, stable_dtstamp)
+            if props is None:
+                continue
+
+            vevent = Event()
+            for name, value in props:
+                vevent.add(name, value)
+            cal.add_component(vevent)
 
     # The icalendar library double-escapes \n to \\n in DESCRIPTION.
     # TeamSnap uses literal \n (RFC 5545 text newline), so fix it up.
-    return cal.to_ical().replace(b"\\\\n", b"\\n")
+    with _metrics.span("ical_serialize"):
+        return cal.to_ical().replace(b"\\\\n", b"\\n")
@@ -0,0 +1,301 @@
+"""In-process metrics: counters, latency histograms and request timings.
+
+Spans time the stages of a request. Each one feeds a histogram and, while
+a request is being handled, the Server-Timing header of its response.
+render() writes everything in the Prometheus text format for
+/api/metrics. Values are per process; every serverless instance keeps its
+own.
+"""
+
+import contextvars
+import io
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler
+
+# Opt-in: with PROFILE_REQUESTS=1, ?profile=1 returns a cProfile report of
+# the request instead of its response. PROFILE_DIR also keeps .prof dumps.
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "")
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "ts_calendar_requests_total": "Requests handled, by handler and status.",
+    "ts_calendar_request_seconds": "Request handling time, by handler.",
+    "ts_calendar_span_seconds": "Time spent in each stage of a request.",
+    "ts_calendar_upstream_responses_total":
+        "TeamSnap responses, by endpoint and status code.",
+    "ts_calendar_token_refreshes_total": "OAuth token refreshes, by result.",
+    "ts_calendar_feed_lookups_total":
+        "Feed cache lookups, by result (hit, shared, stale, miss, stale_error).",
+    "ts_calendar_prewarm_total":
+        "Prewarm attempts, by result (refreshed, failed, skipped).",
+    "ts_calendar_cache_hits_total": "Cache hits, by cache.",
+    "ts_calendar_cache_misses_total": "Cache misses, by cache.",
+    "ts_calendar_cache_evictions_total": "Cache evictions, by cache.",
+    "ts_calendar_cache_entries": "Entries held, by cache.",
+    "ts_calendar_cache_bytes": "Approximate bytes held, by cache.",
+}
+
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+_caches = {}  # name -> TTLCache
+_lock = threading.Lock()
+
+_current = contextvars.ContextVar("ts_calendar_request", default=None)
+_profiling = contextvars.ContextVar("ts_calendar_profiling", default=False)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                hist[i] += 1
+        hist[-2] += value
+        hist[-1] += 1
+
+
+def register_cache(name, cache):
+    """Report a TTLCache's own hit/miss/eviction counters under name."""
+    _caches[name] = cache
+
+
+class RequestTimer:
+    """Span totals for one request, for its Server-Timing header."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.status = None
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, span, seconds):
+        with self._lock:
+            self.spans[span] = self.spans.get(span, 0.0) + seconds
+
+    def server_timing(self):
+        """Return the Server-Timing value: each span's total, then the total.
+
+        Spans that ran in parallel (such as upstream calls) are summed, so
+        they can add up to more than the total.
+        """
+        with self._lock:
+            spans = list(self.spans.items())
+        total = time.perf_counter() - self.started
+        return ", ".join(
+            [f"{span};dur={seconds * 1000:.1f}" for span, seconds in spans]
+            + [f"total;dur={total * 1000:.1f}"]
+        )
+
+
+def current_request():
+    return _current.get()
+
+
+@contextmanager
+def span(name, **labels):
+    """Time the enclosed block as stage name."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe("ts_calendar_span_seconds", elapsed, span=name, **labels)
+        timer = _current.get()
+        if timer is not None:
+            timer.add(name, elapsed)
+
+
+def submit(pool, fn, *args):
+    """pool.submit() that keeps the current request's timer in the worker."""
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+class _InlineExecutor:
+    """Runs each submitted call right away, on the submitting thread."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def executor(max_workers):
+    """Return a ThreadPoolExecutor, or an inline one inside profile().
+
+    cProfile only sees the thread it was enabled on, so a profiled build
+    runs its parallel fetches one after another instead.
+    """
+    if _profiling.get():
+        return _InlineExecutor()
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+
+def timed_request(name):
+    """Decorate a do_GET method so the request is timed and counted."""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            timer = RequestTimer(name)
+            token = _current.set(timer)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                _current.reset(token)
+                observe("ts_calendar_request_seconds",
+                        time.perf_counter() - timer.started, handler=name)
+                inc("ts_calendar_requests_total", handler=name,
+                    status=timer.status or "error")
+        return wrapper
+    return decorator
+
+
+class InstrumentedHandler(BaseHTTPRequestHandler):
+    """Adds Server-Timing to responses of requests timed by timed_request."""
+
+    def send_response(self, code, message=None):
+        super().send_response(code, message)
+        timer = _current.get()
+        if timer is not None:
+            timer.status = code
+
+    def end_headers(self):
+        timer = _current.get()
+        if timer is not None:
+            self.send_header("Server-Timing", timer.server_timing())
+        super().end_headers()
+
+    def send_profile(self, fn, *args):
+        """Respond with a cProfile report of fn(*args)."""
+        report = profile(fn, *args).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(report)))
+        self.end_headers()
+        self.wfile.write(report)
+
+
+def profiling_requested(params):
+    return PROFILE_REQUESTS and params.get("profile", [""])[0] == "1"
+
+
+def profile(fn, *args):
+    """Run fn(*args) under cProfile and return the report as text.
+
+    Work fn hands to executor() runs inline, so the report covers it; the
+    timings are those of a build without parallel fetches. Exceptions are
+    reported rather than raised. With PROFILE_DIR set, the raw stats are
+    also dumped there for snakeviz or pstats.
+    """
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    error = None
+    token = _profiling.set(True)
+    profiler.enable()
+    try:
+        fn(*args)
+    except Exception as e:
+        error = e
+    finally:
+        profiler.disable()
+        _profiling.reset(token)
+
+    if PROFILE_DIR:
+        name = getattr(fn, "__name__", "request")
+        profiler.dump_stats(os.path.join(
+            PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.prof"))
+
+    out = io.StringIO()
+    if error is not None:
+        out.write(f"Error: {error!r}\n\n")
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+    return out.getvalue()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Return every metric in the Prometheus text exposition format."""
+    for cache_name, cache in _caches.items():
+        stats = cache.stats()
+        for stat, metric in (("hits", "ts_calendar_cache_hits_total"),
+                             ("misses", "ts_calendar_cache_misses_total"),
+                             ("evictions", "ts_calendar_cache_evictions_total"),
+                             ("entries", "ts_calendar_cache_entries"),
+                             ("bytes", "ts_calendar_cache_bytes")):
+            key = _key(metric, {"cache": cache_name})
+            with _lock:
+                _counters[key] = stats[stat]
+
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, list(v)) for k, v in _histograms.items())
+
+    lines = []
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            typed.add(name)
+            if name in HELP:
+                lines.append(f"# HELP {name} {HELP[name]}")
+            kind = "counter" if name.endswith("_total") else "gauge"
+            lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    for (name, labels), hist in histograms:
+        if name not in typed:
+            typed.add(name)
+            if name in HELP:
+                lines.append(f"# HELP {name} {HELP[name]}")
+            lines.append(f"# TYPE {name} histogram")
+        for bound, count in zip(BUCKETS, hist):
+            bucket = labels + (("le", repr(bound)),)
+            lines.append(f"{name}_bucket{_format_labels(bucket)} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))}"
+                     f" {hist[-1]}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(hist[-2])}")
+        lines.append(f"{name}_count{_format_labels(labels)} {hist[-1]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,197 @@
+"""Registry of recently requested feeds, refreshed before they go stale.
+
+Feed requests are tracked by cache key. Prewarmer.run() rebuilds tracked
+feeds that are about to expire, on a small thread pool, so the next poll
+finds a fresh feed instead of paying for the build. Keys that haven't been
+requested for idle_timeout seconds drop out, and so do keys whose prewarm
+fails until they are requested (and built) again.
+
+With a shared backend (CACHE_BACKEND_URL) the registry is also kept there,
+so a cron invocation on one instance can refresh feeds polled on others.
+"""
+
+import importlib
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api import _metrics
+from api._cache_backend import get_backend
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_KEY = "prewarm:registry"
+
+
+def _build_name(build):
+    return f"{build.__module__}:{build.__qualname__}"
+
+
+def _resolve_build(name):
+    module, _, attr = name.partition(":")
+    # Only the app's own builders, whatever the shared registry says
+    if not module.startswith("api."):
+        raise ValueError(f"Refusing to prewarm with {name}")
+    return getattr(importlib.import_module(module), attr)
+
+
+class Prewarmer:
+    def __init__(self, idle_timeout=3600, jitter=30, concurrency=2,
+                 max_per_run=100, max_keys=500, save_interval=60):
+        self.idle_timeout = idle_timeout
+        self.jitter = jitter
+        self.concurrency = concurrency
+        self.max_per_run = max_per_run
+        self.max_keys = max_keys
+        self.save_interval = save_interval
+        # cache_key -> {"build", "args", "last_requested", "jitter"}
+        self._keys = {}
+        # cache_key -> when it was forgotten, so merges don't bring it back
+        self._forgotten = {}
+        self._saved_at = 0.0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def track(self, cache_key, build, args):
+        """Record a request for cache_key, built by build(*args)."""
+        now = time.time()
+        with self._lock:
+            record = self._keys.get(cache_key)
+            if record is None:
+                record = self._keys[cache_key] = {
+                    "build": _build_name(build),
+                    "args": list(args),
+                    # Spreads keys tracked together over several runs
+                    "jitter": random.uniform(0, self.jitter),
+                }
+                self._forgotten.pop(cache_key, None)
+            record["last_requested"] = now
+            if len(self._keys) > self.max_keys:
+                oldest = min(self._keys,
+                             key=lambda k: self._keys[k]["last_requested"])
+                del self._keys[oldest]
+        if (now - self._saved_at >= self.save_interval
+                and get_backend() is not None):
+            # Off the request path: a save reads and writes the whole
+            # registry. On serverless it may finish on a later invocation.
+            self._saved_at = now
+            threading.Thread(target=self.save, daemon=True).start()
+
+    def _drop_idle(self, now):
+        """Forget keys nobody has requested for idle_timeout. Hold self._lock."""
+        for key in [k for k, r in self._keys.items()
+                    if now - r["last_requested"] > self.idle_timeout]:
+            del self._keys[key]
+        for key in [k for k, t in self._forgotten.items()
+                    if now - t > self.idle_timeout]:
+            del self._forgotten[key]
+
+    def forget(self, cache_key):
+        """Stop prewarming cache_key until it is tracked again."""
+        with self._lock:
+            self._keys.pop(cache_key, None)
+            self._forgotten[cache_key] = time.time()
+
+    def _merge(self, keys):
+        with self._lock:
+            for key, record in keys.items():
+                if record["last_requested"] <= self._forgotten.get(key, 0):
+                    continue
+                mine = self._keys.get(key)
+                if mine is None:
+                    self._keys[key] = dict(
+                        record, jitter=random.uniform(0, self.jitter))
+                elif record["last_requested"] > mine["last_requested"]:
+                    mine["last_requested"] = record["last_requested"]
+            self._drop_idle(time.time())
+
+    def load(self):
+        """Merge in the registry kept in the shared backend, if any."""
+        backend = get_backend()
+        if backend is None:
+            return
+        try:
+            raw = backend.get(REGISTRY_KEY)
+        except Exception:
+            logger.exception("Could not read the prewarm registry")
+            return
+        if raw:
+            self._merge(json.loads(raw))
+
+    def save(self):
+        """Write the registry, merged with the shared one, to the backend."""
+        backend = get_backend()
+        # One save at a time; callers that find one running skip theirs
+        if backend is None or not self._save_lock.acquire(blocking=False):
+            return
+        try:
+            self._saved_at = time.time()
+            self.load()
+            with self._lock:
+                keys = {
+                    key: {"build": r["build"], "args": r["args"],
+                          "last_requested": r["last_requested"]}
+                    for key, r in self._keys.items()
+                }
+            backend.set(REGISTRY_KEY, json.dumps(keys).encode(),
+                        self.idle_timeout)
+        except Exception:
+            logger.exception("Could not store the prewarm registry")
+        finally:
+            self._save_lock.release()
+
+    def run(self, age_of, refresh, max_age, deadline=None):
+        """Refresh the tracked feeds that are due.
+
+        A feed is due when age_of(cache_key) returns None (not cached) or
+        an age past max_age less the key's jitter. refresh(cache_key,
+        build, args) rebuilds one feed. Feeds not started by deadline (a
+        time.time() value) are skipped. Returns counts of the outcomes.
+        """
+        self.load()
+        with self._lock:
+            self._drop_idle(time.time())
+            records = list(self._keys.items())
+
+        due = []
+        for key, record in records:
+            age = age_of(key)
+            if age is None or age >= max_age - record["jitter"]:
+                due.append((float("inf") if age is None else age, key, record))
+        # Stalest first, in case the budget runs out
+        due.sort(key=lambda d: d[0], reverse=True)
+
+        results = {"tracked": len(records), "due": len(due), "refreshed": 0,
+                   "failed": 0, "skipped": max(0, len(due) - self.max_per_run)}
+        lock = threading.Lock()
+
+        def refresh_one(key, record):
+            if deadline is not None and time.time() >= deadline:
+                result = "skipped"
+            else:
+                try:
+                    refresh(key, _resolve_build(record["build"]),
+                            tuple(record["args"]))
+                    result = "refreshed"
+                except Exception:
+                    logger.exception("Prewarming %s failed, forgetting it", key)
+                    # Bad ids and broken builds would otherwise be retried
+                    # every run, ahead of feeds that do build
+                    self.forget(key)
+                    result = "failed"
+            _metrics.inc("ts_calendar_prewarm_total", result=result)
+            with lock:
+                results[result] += 1
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for _, key, record in due[:self.max_per_run]:
+                pool.submit(refresh_one, key, record)
+
+        self.save()
+        return results
@@ -0,0 +1,77 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+from api._ical_generator import _parse_dt
+
+
+class _Record:
+    """Slotted record built from a Collection+JSON item.
+
+    Only the fields the feed uses are kept. get() and [] mirror the dict
+    interface so records can stand in for the full item dicts.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_item(cls, item):
+        fields = cls.__slots__
+        values = dict.fromkeys(fields)
+        for entry in item.get("data", []):
+            name = entry["name"]
+            if name in values:
+                values[name] = entry["value"]
+        return cls(*(values[f] for f in fields))
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+
+@dataclass(slots=True)
+class EventRecord(_Record):
+    id: int
+    team_id: int
+    name: str
+    is_game: bool
+    opponent_id: int
+    location_id: int
+    notes: str
+    is_canceled: bool
+    start_date: datetime
+    end_date: datetime
+    updated_at: str
+    created_at: str
+
+    def __post_init__(self):
+        # Parsed once at ingest instead of on every render
+        if isinstance(self.start_date, str):
+            self.start_date = _parse_dt(self.start_date)
+        if isinstance(self.end_date, str):
+            self.end_date = _parse_dt(self.end_date)
+
+
+@dataclass(slots=True)
+class LocationRecord(_Record):
+    id: int
+    name: str
+    address: str
+
+
+@dataclass(slots=True)
+class OpponentRecord(_Record):
+    id: int
+    name: str
+
+
+@dataclass(slots=True)
+class AvailabilityRecord(_Record):
+    id: int
+    member_id: int
+    event_id: int
+    status_code: int
@@ -0,0 +1,109 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+from api import _metrics
+from api._cache import _estimate_size
+from api._teamsnap_client import TIMESTAMP_FORMAT
+
+# A full download replaces the snapshot at this interval, which is how
+# deleted events, locations and opponents disappear from it.
+FULL_SYNC_INTERVAL = 3600  # 1 hour
+# Deltas are requested from slightly before the last sync to tolerate clock
+# skew between us and TeamSnap.
+SYNC_OVERLAP = 120  # 2 minutes
+
+
+def _by_id(items):
+    return {item["id"]: item for item in items}
+
+
+def _merge(current, delta):
+    """Merge delta into current; returns True if any record changed.
+
+    Deltas may repeat unchanged records (TeamSnap can ignore updated_since),
+    and those must not count as changes.
+    """
+    changed = False
+    for key, item in delta.items():
+        if current.get(key) != item:
+            current[key] = item
+            changed = True
+    return changed
+
+
+class TeamSnapshot:
+    """Local copy of a team's events, locations and opponents.
+
+    sync() asks TeamSnap only for records updated since the previous sync
+    and merges them in, falling back to a full download every
+    FULL_SYNC_INTERVAL to reconcile deletions.
+    """
+
+    def __init__(self, team_id):
+        self.team_id = team_id
+        self.events = {}
+        self.locations = {}
+        self.opponents = {}
+        self.synced_at = None
+        self.full_synced_at = None
+        # Bumped whenever locations or opponents change, since rendered
+        # events embed their names and addresses.
+        self.context_version = 0
+        self.fragments = {}
+        self.fragment_context = None
+        self.lock = threading.Lock()
+
+    def sync(self, client, pool):
+        """Bring the snapshot up to date, using pool for the parallel fetches.
+
+        Returns True if this was a full download.
+        """
+        with self.lock:
+            started = time.time()
+            full = (self.synced_at is None
+                    or started - self.full_synced_at >= FULL_SYNC_INTERVAL)
+            since = None
+            if not full:
+                since = datetime.fromtimestamp(
+                    self.synced_at - SYNC_OVERLAP, timezone.utc
+                ).strftime(TIMESTAMP_FORMAT)
+
+            # Items are indexed page by page as they stream in, as compact
+            # records holding only the fields the feed uses
+            events_future = _metrics.submit(
+                pool, _by_id,
+                client.iter_events(self.team_id, since, compact=True))
+            locations_future = _metrics.submit(
+                pool, _by_id,
+                client.iter_locations(self.team_id, since, compact=True))
+            opponents_future = _metrics.submit(
+                pool, _by_id,
+                client.iter_opponents(self.team_id, since, compact=True))
+            events = events_future.result()
+            locations = locations_future.result()
+            opponents = opponents_future.result()
+
+            if full:
+                changed = (locations != self.locations
+                           or opponents != self.opponents)
+                self.events = events
+                self.locations = locations
+                self.opponents = opponents
+                self.full_synced_at = started
+                if changed:
+                    self.context_version += 1
+            else:
+                self.events.update(events)
+                # Not short-circuited: both must be merged
+                changed = _merge(self.locations, locations)
+                changed = _merge(self.opponents, opponents) or changed
+                if changed:
+                    self.context_version += 1
+            self.synced_at = started
+            return full
+
+    def size(self):
+        """Approximate memory held by the snapshot, in bytes."""
+        return (_estimate_size(self.events) + _estimate_size(self.locations)
+                + _estimate_size(self.opponents) + _estimate_size(self.fragments))
@@ -1,57 +1,310 @@
+import hashlib
+import json
+import logging
 import os
+import threading
+import time
 from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
 
-import requests
+from api import _metrics
+from api._cache_backend import get_backend
+from api._records import (
+    AvailabilityRecord, EventRecord, LocationRecord, OpponentRecord,
+)
 
-BASE_URL = "https://api.teamsnap.com/v3"
-TOKEN_URL = "https://auth.teamsnap.com/oauth/token"
+logger = logging.getLogger(__name__)
+
+# Overridable so benchmarks can point the client at a local stand-in
+BASE_URL = os.environ.get("TEAMSNAP_BASE_URL", "https://api.teamsnap.com/v3")
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+TOKEN_URL = os.environ.get("TEAMSNAP_TOKEN_URL",
+                           "https://auth.teamsnap.com/oauth/token")
+
+# Connection pool shared by every client in the process
+POOL_SIZE = int(os.environ.get("TEAMSNAP_POOL_SIZE", "10"))
+MAX_RETRIES = int(os.environ.get("TEAMSNAP_MAX_RETRIES", "3"))
+RETRY_BACKOFF = float(os.environ.get("TEAMSNAP_RETRY_BACKOFF", "0.5"))
+# Longest wait before a retry. Retry-After is not honoured: a 429 asking
+# for a minute would hold the request (and the feed's single-flight) past
+# the function timeout, where a stale feed can be served instead.
+RETRY_BACKOFF_MAX = 2.0
+
+# Items requested per page of a search
+PAGE_SIZE = int(os.environ.get("TEAMSNAP_PAGE_SIZE", "500"))
+
+# Refreshed tokens are shared through the cache backend, so cold instances
+# reuse them instead of the (possibly revoked) ones from the environment.
+# The shared token is tied to the environment tokens it was refreshed
+# from, so new tokens from setup_auth.py replace it.
+TOKEN_KEY = "teamsnap:token"
+TOKEN_TTL = 90 * 86400  # 90 days
+# Access tokens are refreshed this long before they expire, so requests
+# don't pay for a 401 and a retry.
+REFRESH_MARGIN = 300  # 5 minutes
+
+_session = None
+_client = None
+_lock = threading.RLock()
+
+
+def _get_session():
+    """Return the process-wide keep-alive session, creating it on first use.
+
+    The session outlives a single request on warm serverless instances, so
+    later requests reuse open connections to TeamSnap instead of paying a new
+    TCP+TLS handshake per call.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            # Imported here so cold starts answered from cache don't load
+            # requests and urllib3
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            retry = Retry(
+                total=MAX_RETRIES,
+                backoff_factor=RETRY_BACKOFF,
+                backoff_max=RETRY_BACKOFF_MAX,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(["GET"]),
+                respect_retry_after_header=False,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE,
+                                  max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["Accept-Encoding"] = "gzip, deflate"
+            _session = session
+        return _session
+
+
+def get_client():
+    """Return the process-wide TeamSnapClient, creating it on first use."""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = TeamSnapClient()
+        return _client
+
+
+def _iter_collection_items(response_json, record=None):
+    """Yield Collection+JSON items as flat dicts.
+
+    If record is given (one of the api._records classes), yield compact
+    records holding only its fields instead.
+    """
+    for item in response_json.get("collection", {}).get("items", []):
+        if record is not None:
+            yield record.from_item(item)
+        else:
+            yield {entry["name"]: entry["value"] for entry in item.get("data", [])}
 
 
 def _parse_collection_items(response_json):
     """Convert Collection+JSON items to list of flat dicts."""
-    items = response_json.get("collection", {}).get("items", [])
-    result = []
-    for item in items:
-        obj = {entry["name"]: entry["value"] for entry in item.get("data", [])}
-        result.append(obj)
-    return result
+    return list(_iter_collection_items(response_json))
 
 
-class TeamSnapClient:
+def _next_link(response_json):
+    """Return the href of the collection's "next" page link, if any."""
+    for link in response_json.get("collection", {}).get("links", []):
+        if link.get("rel") == "next":
+            return link.get("href")
+    return None
+
+
+def _endpoint(url):
+    """Name the API endpoint of url for metrics, e.g. "events" or "teams"."""
+    path = urlparse(url).path.removeprefix(urlparse(BASE_URL).path)
+    return path.strip("/").split("/", 1)[0] or "root"
+
+
+def index_availabilities(availabilities):
+    """Index availabilities by (member_id, event_id).
+
+    member_id is stored as a string so lookups work with IDs taken straight
+    from a query string.
+    """
+    return {(str(a["member_id"]), a["event_id"]): a for a in availabilities}
+
+
+class _TokenState:
+    """OAuth tokens shared by every TeamSnapClient in the process.
+
+    expires_at is unknown for the tokens from the environment until the
+    first refresh; those rely on the 401 fallback in TeamSnapClient._get.
+    """
+
     def __init__(self):
         self.access_token = os.environ["TEAMSNAP_ACCESS_TOKEN"]
         self.refresh_token = os.environ.get("TEAMSNAP_REFRESH_TOKEN", "")
+        self.expires_at = None
+        # Identifies the environment tokens without storing them again
+        self.source = hashlib.sha256(
+            f"{self.access_token}\n{self.refresh_token}".encode()
+        ).hexdigest()[:32]
+        # Held while refreshing, so only one refresh runs at a time and the
+        # rotated refresh_token can't be raced over.
+        self.lock = threading.Lock()
+        self.load_shared()
+
+    def needs_refresh(self):
+        return (self.expires_at is not None
+                and time.time() >= self.expires_at - REFRESH_MARGIN)
+
+    def load_shared(self):
+        """Adopt the token in the shared backend, if any.
+
+        A token refreshed from other environment tokens is ignored. Returns
+        True if it differs from the one held here.
+        """
+        backend = get_backend()
+        if backend is None:
+            return False
+        try:
+            raw = backend.get(TOKEN_KEY)
+        except Exception:
+            logger.exception("Could not read the shared token")
+            return False
+        if raw is None:
+            return False
+        try:
+            data = json.loads(raw)
+            access_token = data["access_token"]
+        except (ValueError, TypeError, KeyError):
+            logger.exception("Ignoring an unreadable shared token")
+            return False
+        if data.get("source") != self.source:
+            return False
+        changed = access_token != self.access_token
+        self.access_token = access_token
+        self.refresh_token = data.get("refresh_token") or self.refresh_token
+        self.expires_at = data.get("expires_at")
+        return changed
+
+    def store_shared(self):
+        backend = get_backend()
+        if backend is None:
+            return
+        data = json.dumps({
+            "access_token": self.access_token,
+            "refresh_token": self.refresh_token,
+            "expires_at": self.expires_at,
+            "source": self.source,
+        })
+        try:
+            backend.set(TOKEN_KEY, data.encode(), TOKEN_TTL)
+        except Exception:
+            logger.exception("Could not store the shared token")
+
+
+_token = None
+
+
+def _get_token():
+    """Return the process-wide token state, creating it on first use."""
+    global _token
+    with _lock:
+        if _token is None:
+            _token = _TokenState()
+        return _token
+
+
+class TeamSnapClient:
+    def __init__(self):
+        self.token = _get_token()
         self.client_id = os.environ.get("TEAMSNAP_CLIENT_ID", "")
         self.client_secret = os.environ.get("TEAMSNAP_CLIENT_SECRET", "")
+        self.session = _get_session()
 
-    def _headers(self):
+    @property
+    def access_token(self):
+        return self.token.access_token
+
+    @property
+    def refresh_token(self):
+        return self.token.refresh_token
+
+    def _headers(self, access_token):
         return {
-            "Authorization": f"Bearer {self.access_token}",
+            "Authorization": f"Bearer {access_token}",
             "Accept": "application/vnd.collection+json",
         }
 
     def _refresh_access_token(self):
-        if not self.refresh_token or not self.client_id or not self.client_secret:
+        """Refresh the shared token. Callers must hold self.token.lock."""
+        token = self.token
+        # Another instance may already have refreshed (and rotated the
+        # refresh token); use its result instead of refreshing again.
+        if token.load_shared() and not token.needs_refresh():
+            _metrics.inc("ts_calendar_token_refreshes_total", result="shared")
+            return
+        if not token.refresh_token or not self.client_id or not self.client_secret:
             raise RuntimeError("Cannot refresh token: missing credentials")
-        resp = requests.post(TOKEN_URL, data={
-            "grant_type": "refresh_token",
-            "refresh_token": self.refresh_token,
-            "client_id": self.client_id,
-            "client_secret": self.client_secret,
-        }, timeout=15)
-        resp.raise_for_status()
-        data = resp.json()
-        self.access_token = data["access_token"]
+        requested_at = time.time()
+        try:
+            with _metrics.span("token_refresh"):
+                resp = self.session.post(TOKEN_URL, data={
+                    "grant_type": "refresh_token",
+                    "refresh_token": token.refresh_token,
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                }, timeout=15)
+                resp.raise_for_status()
+                data = resp.json()
+        except Exception:
+            _metrics.inc("ts_calendar_token_refreshes_total", result="error")
+            raise
+        _metrics.inc("ts_calendar_token_refreshes_total", result="ok")
+        token.access_token = data["access_token"]
         if "refresh_token" in data:
-            self.refresh_token = data["refresh_token"]
+            token.refresh_token = data["refresh_token"]
+        expires_in = data.get("expires_in")
+        token.expires_at = requested_at + expires_in if expires_in else None
+        token.store_shared()
+
+    def _valid_access_token(self):
+        """Return the access token, refreshing it first if it is about to expire."""
+        token = self.token
+        if token.needs_refresh():
+            with token.lock:
+                if token.needs_refresh():
+                    try:
+                        self._refresh_access_token()
+                    except Exception:
+                        # The current token may still have a little life
+                        # left; the 401 fallback in _get covers the rest.
+                        logger.exception("Proactive token refresh failed")
+        return token.access_token
 
     def _get(self, url, params=None):
-        resp = requests.get(url, headers=self._headers(), params=params, timeout=15)
+        endpoint = _endpoint(url)
+        access_token = self._valid_access_token()
+        resp = self._send(url, endpoint, access_token, params)
         if resp.status_code == 401:
-            self._refresh_access_token()
-            resp = requests.get(url, headers=self._headers(), params=params, timeout=15)
+            # Several requests may hit 401 at once when they run concurrently.
+            # Only the first one refreshes; the others retry with its token.
+            with self.token.lock:
+                if self.token.access_token == access_token:
+                    self._refresh_access_token()
+                access_token = self.token.access_token
+            resp = self._send(url, endpoint, access_token, params)
         resp.raise_for_status()
-        return resp.json()
+        with _metrics.span("decode"):
+            return resp.json()
+
+    def _send(self, url, endpoint, access_token, params):
+        with _metrics.span("upstream", endpoint=endpoint):
+            resp = self.session.get(url, headers=self._headers(access_token),
+                                    params=params, timeout=15)
+        _metrics.inc("ts_calendar_upstream_responses_total",
+                     endpoint=endpoint, status=resp.status_code)
+        return resp
 
     def get_user_id(self):
         data = self._get(f"{BASE_URL}/me")
@@ -69,31 +322,101 @@ class TeamSnapClient:
             raise ValueError(f"No member found for user {user_id} on team {team_id}")
         return items[0]["id"]
 
-    def get_events(self, team_id):
+    def _iter_search(self, url, params, record=None):
+        """Yield the items of a search, one page at a time.
+
+        Follows the collection's "next" link when TeamSnap provides one and
+        otherwise asks for the next page_number while pages come back full.
+        Only one page is held in memory at a time. See
+        _iter_collection_items for record.
+        """
+        params = dict(params, page_size=PAGE_SIZE, page_number=1)
+        seen = set()
+        while url:
+            data = self._get(url, params=params)
+            count = 0
+            new = 0
+            for item in _iter_collection_items(data, record):
+                count += 1
+                item_id = item.get("id")
+                if item_id is not None:
+                    if item_id in seen:
+                        continue
+                    seen.add(item_id)
+                new += 1
+                yield item
+            # Stop if the server ignored the page parameters and repeated itself
+            if not new:
+                return
+            next_url = _next_link(data)
+            if next_url:
+                url, params = next_url, None
+            elif count >= PAGE_SIZE and params is not None:
+                params = dict(params, page_number=params["page_number"] + 1)
+            else:
+                return
+
+    def iter_events(self, team_id, updated_since=None, compact=False):
         started_after = (datetime.now(timezone.utc) - timedelta(days=30)).strftime(
-            "%Y-%m-%dT%H:%M:%SZ"
+            TIMESTAMP_FORMAT
         )
-        data = self._get(f"{BASE_URL}/events/search", params={
+        params = {
             "team_id": team_id,
             "started_after": started_after,
-        })
-        return _parse_collection_items(data)
+        }
+        if updated_since:
+            params["updated_since"] = updated_since
+        return self._iter_search(f"{BASE_URL}/events/search", params,
+                                 EventRecord if compact else None)
+
+    def get_events(self, team_id, updated_since=None):
+        return list(self.iter_events(team_id, updated_since))
 
     def get_availabilities(self, team_id, member_id):
-        data = self._get(f"{BASE_URL}/availabilities/search", params={
+        return list(self._iter_search(f"{BASE_URL}/availabilities/search", {
             "team_id": team_id,
             "member_id": member_id,
-        })
-        return _parse_collection_items(data)
+        }))
 
-    def get_locations(self, team_id):
-        data = self._get(f"{BASE_URL}/locations/search", params={
-            "team_id": team_id,
-        })
-        return _parse_collection_items(data)
+    def iter_team_availabilities(self, team_id, member_ids=None, compact=False):
+        """Yield availabilities for every member of a team.
 
-    def get_opponents(self, team_id):
-        data = self._get(f"{BASE_URL}/opponents/search", params={
+        If member_ids is given, only those members are included.
+        """
+        params = {"team_id": team_id}
+        if member_ids:
+            params["member_id"] = ",".join(str(m) for m in member_ids)
+        return self._iter_search(f"{BASE_URL}/availabilities/search", params,
+                                 AvailabilityRecord if compact else None)
+
+    def get_team_availabilities(self, team_id, member_ids=None):
+        """Fetch availabilities for every member of a team in one request.
+
+        If member_ids is given, only those members are included.
+        """
+        return list(self.iter_team_availabilities(team_id, member_ids))
+
+    def iter_members(self, team_id):
+        return self._iter_search(f"{BASE_URL}/members/search", {
             "team_id": team_id,
         })
-        return _parse_collection_items(data)
+
+    def iter_locations(self, team_id, updated_since=None, compact=False):
+        params = {"team_id": team_id}
+        if updated_since:
+            params["updated_since"] = updated_since
+        return self._iter_search(f"{BASE_URL}/locations/search", params,
+                                 LocationRecord if compact else None)
+
+    def get_locations(self, team_id, updated_since=None):
+        return list(self.iter_locations(team_id, updated_since))
+
+    def iter_opponents(self, team_id, updated_since=None, compact=False):
+        params = {"team_id": team_id}
+        if updated_since:
+            params["updated_since"] = updated_since
+        return self._iter_search(f"{BASE_URL}/opponents/search", params,
+                                 OpponentRecord if compact else None)
+
+    def get_opponents(self, team_id, updated_since=None):
+        return list(self.iter_opponents(team_id, updated_since))
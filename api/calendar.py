@@ -1,95 +1,538 @@
+import functools
+import hashlib
+import json
+import logging
 import os
+import re
+import struct
+import threading
 import time
-from http.server import BaseHTTPRequestHandler
+import zlib
+from email.utils import formatdate
 from urllib.parse import parse_qs, urlparse
 
-from api._ical_generator import generate_ical
-from api._teamsnap_client import TeamSnapClient, _parse_collection_items, BASE_URL
+from api import _metrics
+from api._cache import SingleFlight, TTLCache
+from api._cache_backend import get_backend
+from api._http import not_modified, preferred_encoding, send_text
+from api._prewarm import Prewarmer
+from api._ical_generator import (
+    _parse_dt, event_year_range, generate_ical, render_calendar, render_event,
+)
+from api._sync import TeamSnapshot
+from api._teamsnap_client import (
+    get_client, index_availabilities, _parse_collection_items, BASE_URL,
+)
 
-# In-memory cache for warm serverless instances
-_cache = {}
+logger = logging.getLogger(__name__)
+
+# In-memory caches for warm serverless instances. Each is bounded by entry
+# count and size, so long-lived processes don't grow with every subscriber.
 CACHE_TTL = 300  # 5 minutes
+# Past CACHE_TTL a feed is stale: it is still served immediately while one
+# background refresh rebuilds it, for up to STALE_WHILE_REVALIDATE seconds.
+# If a rebuild fails, the stale feed is served for up to STALE_IF_ERROR.
+STALE_WHILE_REVALIDATE = 3600  # 1 hour
+STALE_IF_ERROR = 86400  # 1 day
+_cache = TTLCache(max_entries=512, max_bytes=32 * 1024 * 1024,
+                  ttl=CACHE_TTL + STALE_IF_ERROR)
+_feed_flight = SingleFlight()
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+# Team-wide data (team record, events, locations, opponents) is shared by
+# every member feed on the team, so it is cached once per team_id.
+# Availabilities for the whole team are fetched in one call and cached
+# separately with a shorter TTL, since RSVPs change more often.
+TEAM_CACHE_TTL = 600  # 10 minutes
+_team_cache = TTLCache(max_entries=64, max_bytes=64 * 1024 * 1024,
+                       ttl=TEAM_CACHE_TTL)
+AVAIL_CACHE_TTL = 300  # 5 minutes
+_avail_cache = TTLCache(max_entries=64, max_bytes=32 * 1024 * 1024,
+                        ttl=AVAIL_CACHE_TTL)
+# Per-team snapshots for incremental sync. They outlive the team cache so
+# a refresh only downloads records changed since the last sync.
+SNAPSHOT_TTL = 86400  # 1 day
+_snapshots = TTLCache(max_entries=64, max_bytes=128 * 1024 * 1024,
+                      ttl=SNAPSHOT_TTL)
+# Parallel member builds on one team share a single in-flight fetch
+_team_flight = SingleFlight()
+_avail_flight = SingleFlight()
+
+_metrics.register_cache("feed", _cache)
+_metrics.register_cache("team", _team_cache)
+_metrics.register_cache("availability", _avail_cache)
+_metrics.register_cache("snapshot", _snapshots)
+
+# Upstream requests made in parallel while building a feed
+FETCH_WORKERS = 6
+
+# Feeds requested within PREWARM_IDLE seconds are rebuilt by prewarm()
+# before they go stale, at most PREWARM_CONCURRENCY at a time to go easy
+# on TeamSnap's rate limits.
+PREWARM_IDLE = int(os.environ.get("PREWARM_IDLE", "3600"))
+PREWARM_AHEAD = 60  # seconds before CACHE_TTL
+_prewarmer = Prewarmer(
+    idle_timeout=PREWARM_IDLE,
+    jitter=int(os.environ.get("PREWARM_JITTER", "30")),
+    concurrency=int(os.environ.get("PREWARM_CONCURRENCY", "2")),
+    max_per_run=int(os.environ.get("PREWARM_MAX_PER_RUN", "100")),
+)
+
+# Serialize feeds with the direct RFC 5545 writer rather than icalendar
+FAST_SERIALIZER = os.environ.get("ICAL_FAST_SERIALIZER", "1") != "0"
+
+
+_DTSTAMP_RE = re.compile(rb"^DTSTAMP:[^\r\n]*\r?\n", re.MULTILINE)
+
+
+def _compute_etag(ical_data):
+    """Weak ETag over the feed content, ignoring the per-build DTSTAMPs."""
+    digest = hashlib.sha256(_DTSTAMP_RE.sub(b"", ical_data)).hexdigest()
+    return f'W/"{digest[:32]}"'
 
 
-def _get_cached(team_id):
-    entry = _cache.get(team_id)
-    if entry and (time.time() - entry["ts"]) < CACHE_TTL:
-        return entry["data"]
-    return None
+def _compress(data):
+    """Return (gzip, deflate) encodings of data from one compression pass.
+
+    Both wrap the same raw deflate stream; only headers and checksums differ.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    raw = compressor.compress(data) + compressor.flush()
+    gzip = b"".join([
+        b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff", raw,
+        struct.pack("<II", zlib.crc32(data), len(data) & 0xFFFFFFFF),
+    ])
+    deflate = b"".join([b"\x78\x9c", raw,
+                        struct.pack(">I", zlib.adler32(data))])
+    return gzip, deflate
+
+
+def _make_entry(data, etag, last_modified):
+    """Feed cache entry: the ICS bytes plus their gzip and deflate encodings.
+
+    Compressing once per build means cache hits never recompress.
+    """
+    gzip, deflate = _compress(data)
+    return {"data": data, "gzip": gzip, "deflate": deflate, "etag": etag,
+            "last_modified": last_modified}
 
 
 def _set_cached(team_id, data):
-    _cache[team_id] = {"data": data, "ts": time.time()}
+    """Cache a feed with its ETag and Last-Modified time.
+
+    Last-Modified only moves forward when the content actually changes, so
+    rebuilds of an unchanged feed keep answering conditional requests with 304.
+    """
+    etag = _compute_etag(data)
+    previous = _cache.get(team_id)
+    if previous is not None and previous["etag"] == etag:
+        last_modified = previous["last_modified"]
+    else:
+        last_modified = int(time.time())
+    entry = _make_entry(data, etag, last_modified)
+    built_at = time.time()
+    _cache.set(team_id, entry, stored_at=built_at)
+    _store_shared(team_id, entry, built_at)
+    return entry
+
+
+def _store_shared(cache_key, entry, built_at):
+    """Write a feed entry through to the shared backend, if one is set up.
+
+    The metadata is also stored on its own under feed-meta:, so a feed's
+    age can be checked without fetching the feed.
+    """
+    backend = get_backend()
+    if backend is None:
+        return
+    meta = json.dumps({
+        "etag": entry["etag"],
+        "last_modified": entry["last_modified"],
+        "built_at": built_at,
+    }).encode()
+    try:
+        backend.set(f"feed:{cache_key}", meta + b"\n" + entry["data"],
+                    CACHE_TTL + STALE_IF_ERROR)
+        backend.set(f"feed-meta:{cache_key}", meta, CACHE_TTL + STALE_IF_ERROR)
+    except Exception:
+        logger.exception("Could not store %s in the shared cache", cache_key)
+
+
+def _load_shared(cache_key):
+    """Return (entry, built_at) from the shared backend, or (None, None)."""
+    backend = get_backend()
+    if backend is None:
+        return None, None
+    try:
+        raw = backend.get(f"feed:{cache_key}")
+    except Exception:
+        logger.exception("Could not read %s from the shared cache", cache_key)
+        return None, None
+    if raw is None:
+        return None, None
+    meta, _, data = raw.partition(b"\n")
+    meta = json.loads(meta)
+    entry = _make_entry(data, meta["etag"], meta["last_modified"])
+    return entry, meta["built_at"]
 
 
-def _build_feed(team_id, member_id=None):
-    client = TeamSnapClient()
+def _cached_since(cache, key, fresh_since):
+    """Return cache[key], or None if missing or stored before fresh_since."""
+    value, age = cache.get_with_age(key)
+    if value is not None and fresh_since is not None:
+        if time.time() - age < fresh_since:
+            return None
+    return value
 
-    # 1. Get member_id — use provided one, or look up current user's
-    if not member_id:
-        member_id = client.get_member_id(team_id)
 
-    # 2. Fetch team info
-    team_data = client._get(f"{BASE_URL}/teams/{team_id}")
-    team_items = _parse_collection_items(team_data)
+def _get_team_data(client, team_id, fresh_since=None):
+    """Return the cached team-wide data for team_id, fetching it on a miss.
+
+    Data cached before fresh_since (a time.time() value) is fetched again.
+    """
+    with _metrics.span("team_data"):
+        data = _cached_since(_team_cache, team_id, fresh_since)
+        if data is None:
+            data = _team_flight.do(team_id, _fetch_team_data, client, team_id)
+    return data
+
+
+def _fetch_team_data(client, team_id):
+    snapshot = _snapshots.get(team_id) or TeamSnapshot(team_id)
+    with _metrics.executor(FETCH_WORKERS) as pool:
+        team_future = _metrics.submit(pool, client._get,
+                                      f"{BASE_URL}/teams/{team_id}")
+        with _metrics.span("sync"):
+            snapshot.sync(client, pool)
+        team_items = _parse_collection_items(team_future.result())
+
     team_info = team_items[0] if team_items else {}
-    team_name = team_info.get("name", "TeamSnap")
-    team_tz = team_info.get("time_zone_iana_name") or "UTC"
+    data = {
+        "name": team_info.get("name", "TeamSnap"),
+        "tz": team_info.get("time_zone_iana_name") or "UTC",
+        # Sorted so merged deltas and full downloads produce the same feed
+        "events": sorted(snapshot.events.values(), key=_start_key),
+        "locations_by_id": dict(snapshot.locations),
+        "opponents_by_id": dict(snapshot.opponents),
+    }
+    if FAST_SERIALIZER:
+        # Fragments from the previous sync stay valid for unchanged events
+        # as long as the team and its locations and opponents are the same.
+        context = (data["name"], data["tz"], snapshot.context_version)
+        previous = snapshot.fragments if snapshot.fragment_context == context else {}
+        with _metrics.span("fragments"):
+            data["fragments"] = _render_fragments(data, previous)
+        snapshot.fragments = data["fragments"]
+        snapshot.fragment_context = context
+    _snapshots.set(team_id, snapshot, size=snapshot.size())
+    _team_cache.set(team_id, data)
+    return data
+
+
+def _start_key(ev):
+    start = _parse_dt(ev.get("start_date"))
+    return start is None, start.timestamp() if start else 0, ev["id"]
+
+
+def _event_key(ev):
+    return ev["id"], ev.get("updated_at")
+
+
+def _render_fragments(team, previous=None):
+    """Render every team event to a VEVENT fragment once per team fetch.
+
+    Member feeds are subsets of the same events, so they are assembled by
+    joining the fragments their availabilities select. Fragments are keyed
+    by (event id, updated_at) so an edited event never reuses a stale one;
+    any other fragment found in previous is reused as is.
+    """
+    previous = previous or {}
+    fragments = {}
+    for ev in team["events"]:
+        key = _event_key(ev)
+        fragment = previous.get(key)
+        if fragment is None:
+            fragment = render_event(ev, team["locations_by_id"],
+                                    team["opponents_by_id"],
+                                    team_name=team["name"],
+                                    team_tz_name=team["tz"], stable_dtstamp=True)
+        if fragment is not None:
+            fragments[key] = fragment
+    return fragments
+
+
+def _get_availabilities(client, team_id, fresh_since=None):
+    """Return the cached team-wide availability index, fetching on a miss.
+
+    As with _get_team_data, an index cached before fresh_since is refetched.
+    """
+    with _metrics.span("availabilities"):
+        index = _cached_since(_avail_cache, team_id, fresh_since)
+        if index is None:
+            index = _avail_flight.do(team_id, _fetch_availabilities, client,
+                                     team_id)
+    return index
+
+
+def _fetch_availabilities(client, team_id):
+    index = index_availabilities(
+        client.iter_team_availabilities(team_id, compact=True))
+    _avail_cache.set(team_id, index)
+    return index
+
+
+def _select_events(team_id, member_id=None, fresh_since=None):
+    """Return (team data, events member_id answered Yes or Maybe to).
+
+    Team data and availabilities cached before fresh_since are refetched.
+    """
+    client = get_client()
 
-    # 3. Fetch events, availabilities, locations, and opponents
-    events = client.get_events(team_id)
-    availabilities = client.get_availabilities(team_id, member_id)
-    locations_list = client.get_locations(team_id)
-    opponents_list = client.get_opponents(team_id)
+    # Team data, availabilities and the member lookup are independent, so
+    # fetch them concurrently and let the slowest call set the latency.
+    with _metrics.executor(2) as pool:
+        team_future = _metrics.submit(pool, _get_team_data, client, team_id,
+                                      fresh_since)
+        avail_future = _metrics.submit(pool, _get_availabilities, client,
+                                       team_id, fresh_since)
 
-    # 4. Build lookup maps
-    avail_by_event = {a["event_id"]: a for a in availabilities}
-    locations_by_id = {loc["id"]: loc for loc in locations_list}
-    opponents_by_id = {opp["id"]: opp for opp in opponents_list}
+        # 1. Get member_id — use provided one, or look up current user's
+        if not member_id:
+            with _metrics.span("member_lookup"):
+                member_id = client.get_member_id(team_id)
 
-    # 5. Filter to Yes (1) or Maybe (2)
+        # 2. Wait for availabilities and team-wide data
+        avail_index = avail_future.result()
+        team = team_future.result()
+
+    # 3. Filter to Yes (1) or Maybe (2)
+    member_id = str(member_id)
     filtered = []
+    with _metrics.span("filter"):
+        for ev in team["events"]:
+            avail = avail_index.get((member_id, ev["id"]))
+            if avail and avail.get("status_code") in (1, 2):
+                filtered.append(ev)
+    return team, filtered
+
+
+def _event_fragments(team, events):
+    """Return VEVENT fragments for events, reusing the team's pre-rendered ones."""
+    cached = team.get("fragments") or {}
+    fragments = []
     for ev in events:
-        avail = avail_by_event.get(ev["id"])
-        if avail and avail.get("status_code") in (1, 2):
-            filtered.append(ev)
+        fragment = cached.get(_event_key(ev))
+        if fragment is None:
+            fragment = render_event(ev, team["locations_by_id"],
+                                    team["opponents_by_id"],
+                                    team_name=team["name"],
+                                    team_tz_name=team["tz"], stable_dtstamp=True)
+        if fragment is not None:
+            fragments.append(fragment)
+    return fragments
+
+
+def _build_feed(team_id, member_id=None, fresh_since=None):
+    team, filtered = _select_events(team_id, member_id, fresh_since)
+
+    # 4. Generate iCal, joining the team's pre-rendered events if available
+    with _metrics.span("render"):
+        if team.get("fragments") is not None:
+            return render_calendar(_event_fragments(team, filtered),
+                                   team_name=team["name"],
+                                   team_tz_name=team["tz"],
+                                   years=event_year_range(filtered, team["tz"]))
+        return generate_ical(filtered, team["locations_by_id"],
+                             team["opponents_by_id"],
+                             team_name=team["name"], team_tz_name=team["tz"],
+                             stable_dtstamp=True)
+
+
+def _rebuild_feed(cache_key, build, args, **kwargs):
+    return _set_cached(cache_key, build(*args, **kwargs))
+
+
+def _refresh_feed(cache_key, build, args, fresh_since):
+    try:
+        _feed_flight.do(cache_key, _rebuild_feed, cache_key, build, args,
+                        fresh_since=fresh_since)
+    except Exception:
+        logger.exception("Background refresh of %s failed", cache_key)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(cache_key)
+
+
+def _refresh_in_background(cache_key, build, args, fresh_since):
+    """Start a rebuild of cache_key unless one is already running.
+
+    Team data and availabilities cached before fresh_since are refetched.
+    On serverless platforms the thread may be paused once the response is
+    sent; it then finishes on the instance's next invocation.
+    """
+    with _refreshing_lock:
+        if cache_key in _refreshing:
+            return
+        _refreshing.add(cache_key)
+    threading.Thread(target=_refresh_feed,
+                     args=(cache_key, build, args, fresh_since),
+                     daemon=True).start()
+
+
+def _get_entry(cache_key, build, *args):
+    """Return the cached feed entry for cache_key, building it with build(*args).
+
+    The entry holds the ICS bytes ("data"), their "gzip" and "deflate"
+    encodings, "etag" and "last_modified". Stale entries are served while a
+    background refresh runs.
+    """
+    entry = _lookup_entry(cache_key, build, args)
+    # Only feeds that could be built are worth prewarming
+    _prewarmer.track(cache_key, build, args)
+    return entry
+
+
+def _lookup_entry(cache_key, build, args):
+    entry, age = _cache.get_with_age(cache_key)
+    result = "hit"
+    if entry is None:
+        # A cold instance can still pick up a feed another one built
+        entry, built_at = _load_shared(cache_key)
+        if entry is not None:
+            _cache.set(cache_key, entry, stored_at=built_at)
+            age = time.time() - built_at
+            result = "shared"
+    # The team caches outlive CACHE_TTL, so a rebuild of a stale feed must
+    # not reuse team data that is as old as the feed it replaces
+    fresh_since = None
+    if entry is not None:
+        if age < CACHE_TTL:
+            _metrics.inc("ts_calendar_feed_lookups_total", result=result)
+            return entry
+        fresh_since = time.time() - age
+        if age < CACHE_TTL + STALE_WHILE_REVALIDATE:
+            _metrics.inc("ts_calendar_feed_lookups_total", result="stale")
+            _refresh_in_background(cache_key, build, args, fresh_since)
+            return entry
+
+    try:
+        # Concurrent requests for a cold key share a single build
+        fresh = _feed_flight.do(cache_key, _rebuild_feed, cache_key, build, args,
+                                fresh_since=fresh_since)
+    except Exception:
+        # Entries older than STALE_IF_ERROR have already expired from _cache
+        if entry is not None:
+            logger.exception("Rebuild of %s failed, serving stale feed", cache_key)
+            _metrics.inc("ts_calendar_feed_lookups_total", result="stale_error")
+            return entry
+        raise
+    _metrics.inc("ts_calendar_feed_lookups_total", result="miss")
+    return fresh
 
-    # 6. Generate iCal
-    return generate_ical(filtered, locations_by_id, opponents_by_id,
-                         team_name=team_name, team_tz_name=team_tz)
 
+def _entry_age(cache_key):
+    """Age in seconds of the feed cached under cache_key, or None."""
+    entry, age = _cache.get_with_age(cache_key)
+    if entry is None:
+        built_at = _shared_built_at(cache_key)
+        if built_at is not None:
+            age = time.time() - built_at
+    return age
 
-class handler(BaseHTTPRequestHandler):
+
+def _shared_built_at(cache_key):
+    """Return when the shared backend's copy of cache_key was built, or None."""
+    backend = get_backend()
+    if backend is None:
+        return None
+    try:
+        raw = backend.get(f"feed-meta:{cache_key}")
+    except Exception:
+        logger.exception("Could not read %s from the shared cache", cache_key)
+        return None
+    if raw is None:
+        return None
+    return json.loads(raw)["built_at"]
+
+
+def _prewarm_feed(cache_key, build, args, fresh_since):
+    # Shares the build with any request for the same key
+    _feed_flight.do(cache_key, _rebuild_feed, cache_key, build, args,
+                    fresh_since=fresh_since)
+
+
+def prewarm(ahead=PREWARM_AHEAD, deadline=None):
+    """Rebuild recently requested feeds that go stale within ahead seconds.
+
+    Team data and availabilities cached before the pass started are fetched
+    again, once per team, so a prewarmed feed is really as fresh as its age
+    says. Returns counts of tracked, due, refreshed, failed and skipped feeds.
+    """
+    refresh = functools.partial(_prewarm_feed, fresh_since=time.time())
+    return _prewarmer.run(_entry_age, refresh, CACHE_TTL - ahead,
+                          deadline=deadline)
+
+
+def _get_feed(team_id, member_id=None):
+    """Return the cached feed entry for team_id/member_id (see _get_entry)."""
+    return _get_entry(f"{team_id}:{member_id or 'me'}", _build_feed,
+                      team_id, member_id)
+
+
+class handler(_metrics.InstrumentedHandler):
+    @_metrics.timed_request("calendar")
     def do_GET(self):
         parsed = urlparse(self.path)
         params = parse_qs(parsed.query)
 
         team_id = params.get("team_id", [None])[0]
         if not team_id:
-            self.send_response(400)
-            self.send_header("Content-Type", "text/plain")
-            self.end_headers()
-            self.wfile.write(b"Missing required query parameter: team_id")
+            send_text(self, 400, "Missing required query parameter: team_id")
             return
 
         member_id = params.get("member_id", [None])[0]
 
-        # Check cache (keyed by team_id + member_id)
-        cache_key = f"{team_id}:{member_id or 'me'}"
-        ical_data = _get_cached(cache_key)
-        if not ical_data:
-            try:
-                ical_data = _build_feed(team_id, member_id)
-                _set_cached(cache_key, ical_data)
-            except Exception as e:
-                self.send_response(500)
-                self.send_header("Content-Type", "text/plain")
-                self.end_headers()
-                self.wfile.write(f"Error: {e}".encode())
-                return
+        if _metrics.profiling_requested(params):
+            # Profile a build, bypassing the feed cache
+            self.send_profile(_build_feed, team_id, member_id)
+            return
+
+        try:
+            entry = _get_feed(team_id, member_id)
+        except Exception as e:
+            send_text(self, 500, f"Error: {e}")
+            return
+
+        self._send_feed(entry)
 
+    def _send_feed(self, entry):
+        if not_modified(self.headers, entry["etag"], entry["last_modified"]):
+            self.send_response(304)
+            self._send_cache_headers(entry)
+            self.end_headers()
+            return
+
+        # The entry holds a body for each coding we offer
+        encoding = preferred_encoding(self.headers, ("gzip", "deflate"))
+        body = entry[encoding] if encoding else entry["data"]
         self.send_response(200)
         self.send_header("Content-Type", "text/calendar; charset=utf-8")
-        self.send_header("Cache-Control", "public, max-age=300")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self._send_cache_headers(entry)
         self.end_headers()
-        self.wfile.write(ical_data)
+        self.wfile.write(body)
+
+    def _send_cache_headers(self, entry):
+        self.send_header(
+            "Cache-Control",
+            f"public, max-age={CACHE_TTL}, "
+            f"stale-while-revalidate={STALE_WHILE_REVALIDATE}, "
+            f"stale-if-error={STALE_IF_ERROR}",
+        )
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("ETag", entry["etag"])
+        self.send_header("Last-Modified",
+                         formatdate(entry["last_modified"], usegmt=True))
@@ -0,0 +1,73 @@
+from urllib.parse import parse_qs, urlparse
+
+from api import _metrics
+from api._http import send_text
+from api._ical_generator import event_year_range, render_merged_calendar
+from api.calendar import (
+    _event_fragments, _get_entry, _select_events, handler as _FeedHandler,
+)
+
+# Upper bound on teams per combined feed, to keep upstream load reasonable
+MAX_FEEDS = 10
+
+
+def _parse_feeds(values):
+    """Parse feed=TEAM_ID[:MEMBER_ID] values (repeated or comma-separated)."""
+    pairs = []
+    for value in values:
+        for part in value.split(","):
+            team_id, _, member_id = part.strip().partition(":")
+            if team_id:
+                pairs.append((team_id, member_id or None))
+    # Canonical order, so the same set of feeds shares one cache entry
+    return sorted(set(pairs), key=lambda p: (p[0], p[1] or ""))
+
+
+def _build_combined_feed(pairs, fresh_since=None):
+    # Teams are fetched in parallel; each reuses the team-level caches
+    with _metrics.executor(len(pairs)) as pool:
+        futures = [_metrics.submit(pool, _select_events, team_id, member_id,
+                                   fresh_since)
+                   for team_id, member_id in pairs]
+        selections = [future.result() for future in futures]
+
+    parts = []
+    names = []
+    seen = set()
+    for (team_id, _), (team, events) in zip(pairs, selections):
+        # Siblings on the same team share events; list each event once
+        events = [ev for ev in events if (team_id, ev["id"]) not in seen]
+        seen.update((team_id, ev["id"]) for ev in events)
+        parts.append((team["tz"], event_year_range(events, team["tz"]),
+                      _event_fragments(team, events)))
+        if team["name"] not in names:
+            names.append(team["name"])
+
+    return render_merged_calendar(parts,
+                                  cal_name=f"{' + '.join(names)} (Attending)")
+
+
+class handler(_FeedHandler):
+    @_metrics.timed_request("feeds")
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = parse_qs(parsed.query)
+
+        pairs = _parse_feeds(params.get("feed", []))
+        if not pairs or len(pairs) > MAX_FEEDS:
+            send_text(self, 400, f"Pass 1 to {MAX_FEEDS} feed=TEAM_ID[:MEMBER_ID]"
+                                 " query parameters")
+            return
+
+        if _metrics.profiling_requested(params):
+            self.send_profile(_build_combined_feed, pairs)
+            return
+
+        cache_key = "multi:" + ",".join(f"{t}:{m or 'me'}" for t, m in pairs)
+        try:
+            entry = _get_entry(cache_key, _build_combined_feed, pairs)
+        except Exception as e:
+            send_text(self, 500, f"Error: {e}")
+            return
+
+        self._send_feed(entry)
@@ -1,8 +1,24 @@
+import hashlib
 import os
-from http.server import BaseHTTPRequestHandler
+import re
 from urllib.parse import parse_qs, urlparse
 
-from api._teamsnap_client import TeamSnapClient, _parse_collection_items, BASE_URL
+from api import _metrics
+from api._cache import SingleFlight, TTLCache
+from api._http import not_modified, send_text
+from api._teamsnap_client import get_client, _parse_collection_items, BASE_URL
+
+# Rendered pages for warm serverless instances, bounded like the feed
+# caches. A page is rendered from nothing but the roster, so caching it
+# caches the roster too.
+ROSTER_CACHE_TTL = 300  # 5 minutes
+_page_cache = TTLCache(max_entries=64, max_bytes=8 * 1024 * 1024,
+                       ttl=ROSTER_CACHE_TTL)
+_page_flight = SingleFlight()
+_metrics.register_cache("members_page", _page_cache)
+
+# Placeholders in HTML_TEMPLATE, filled per team by _render_page
+_SLOT_RE = re.compile(r'TEAM_NAME|MEMBER_OPTIONS|TEAM_ID|PW_HASH|id="login"')
 
 HTML_TEMPLATE = """<!DOCTYPE html>
 <html lang="en">
@@ -106,65 +122,123 @@ def _simple_hash(s):
     return str(h)
 
 
-class handler(BaseHTTPRequestHandler):
+def _get_roster(team_id):
+    """Return (team_name, sorted members list) for team_id."""
+    client = get_client()
+
+    # Fetch team name
+    team_data = client._get(f"{BASE_URL}/teams/{team_id}")
+    team_items = _parse_collection_items(team_data)
+    team_name = team_items[0].get("name", "TeamSnap") if team_items else "TeamSnap"
+
+    members_list = [
+        {
+            "member_id": m.get("id"),
+            "name": f"{m.get('first_name', '')} {m.get('last_name', '')}".strip(),
+        }
+        for m in client.iter_members(team_id)
+    ]
+    members_list.sort(key=lambda m: m["name"])
+
+    return team_name, members_list
+
+
+def _compile_template(template):
+    """Split template into encoded static chunks and slot names."""
+    parts = []
+    pos = 0
+    for match in _SLOT_RE.finditer(template):
+        parts.append(template[pos:match.start()].encode())
+        parts.append(match.group())
+        pos = match.end()
+    parts.append(template[pos:].encode())
+    return parts
+
+
+_TEMPLATE_PARTS = _compile_template(HTML_TEMPLATE)
+
+
+def _render_page(team_id, team_name, members_list):
+    """Fill the compiled template's slots, returning a list of byte chunks."""
+    options = "\n    ".join(
+        f'<option value="{m["member_id"]}">{m["name"]}</option>'
+        for m in members_list
+    )
+
+    password = os.environ.get("FEED_PASSWORD", "")
+    pw_hash = _simple_hash(password) if password else ""
+
+    values = {
+        "TEAM_NAME": team_name.encode(),
+        "MEMBER_OPTIONS": options.encode(),
+        "TEAM_ID": str(team_id).encode(),
+        "PW_HASH": pw_hash.encode(),
+        # If no password configured, skip the login screen
+        'id="login"': (b'id="login"' if password
+                       else b'id="login" style="display:none"'),
+    }
+    return [values[part] if isinstance(part, str) else part
+            for part in _TEMPLATE_PARTS]
+
+
+def _get_page(team_id):
+    """Return the rendered members page for team_id, cached with its ETag."""
+    page = _page_cache.get(team_id)
+    if page is None:
+        # Concurrent first visits share one roster fetch
+        page = _page_flight.do(team_id, _build_page, team_id)
+    return page
+
+
+def _build_page(team_id):
+    team_name, members_list = _get_roster(team_id)
+    with _metrics.span("render"):
+        chunks = _render_page(team_id, team_name, members_list)
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    page = {
+        "chunks": chunks,
+        "length": sum(len(chunk) for chunk in chunks),
+        "etag": f'"{digest.hexdigest()[:32]}"',
+    }
+    _page_cache.set(team_id, page)
+    return page
+
+
+class handler(_metrics.InstrumentedHandler):
+    @_metrics.timed_request("members")
     def do_GET(self):
         parsed = urlparse(self.path)
         params = parse_qs(parsed.query)
 
         team_id = params.get("team_id", [None])[0]
         if not team_id:
-            self.send_response(400)
-            self.send_header("Content-Type", "text/plain")
-            self.end_headers()
-            self.wfile.write(b"Missing required query parameter: team_id")
+            send_text(self, 400, "Missing required query parameter: team_id")
             return
 
         try:
-            client = TeamSnapClient()
-
-            # Fetch team name
-            team_data = client._get(f"{BASE_URL}/teams/{team_id}")
-            team_items = _parse_collection_items(team_data)
-            team_name = team_items[0].get("name", "TeamSnap") if team_items else "TeamSnap"
-
-            data = client._get(f"{BASE_URL}/members/search", params={
-                "team_id": team_id,
-            })
-            members = _parse_collection_items(data)
-            members_list = [
-                {
-                    "member_id": m.get("id"),
-                    "name": f"{m.get('first_name', '')} {m.get('last_name', '')}".strip(),
-                }
-                for m in members
-            ]
-            members_list.sort(key=lambda m: m["name"])
-
-            options = "\n    ".join(
-                f'<option value="{m["member_id"]}">{m["name"]}</option>'
-                for m in members_list
-            )
-
-            password = os.environ.get("FEED_PASSWORD", "")
-            pw_hash = _simple_hash(password) if password else ""
-
-            html = HTML_TEMPLATE.replace("TEAM_NAME", team_name)
-            html = html.replace("MEMBER_OPTIONS", options)
-            html = html.replace("TEAM_ID", str(team_id))
-            html = html.replace("PW_HASH", pw_hash)
-
-            # If no password configured, skip the login screen
-            if not password:
-                html = html.replace('id="login"', 'id="login" style="display:none"')
-                html = html.replace('id="content" style="display: none;"', 'id="content"')
-                html = html.replace('id="content" style="display:none"', 'id="content"')
-
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html.encode())
+            page = _get_page(team_id)
         except Exception as e:
-            self.send_response(500)
-            self.send_header("Content-Type", "text/plain")
+            send_text(self, 500, f"Error: {e}")
+            return
+
+        if not_modified(self.headers, page["etag"]):
+            self.send_response(304)
+            self._send_cache_headers(page)
             self.end_headers()
-            self.wfile.write(f"Error: {e}".encode())
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(page["length"]))
+        self._send_cache_headers(page)
+        self.end_headers()
+        for chunk in page["chunks"]:
+            self.wfile.write(chunk)
+
+    def _send_cache_headers(self, page):
+        # Browsers revalidate on every visit and get a 304 while the roster
+        # is unchanged
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("ETag", page["etag"])
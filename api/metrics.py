@@ -0,0 +1,33 @@
+import hmac
+import os
+from http.server import BaseHTTPRequestHandler
+
+from api import _metrics
+# Imported for their registered caches and metrics
+from api import calendar, members  # noqa: F401
+
+
+# Metrics are per process: this covers every endpoint under serve_local.py,
+# but on Vercel each api/*.py runs in its own instances and this one only
+# sees its own requests.
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # Optional bearer token, so the metrics aren't public
+        token = os.environ.get("METRICS_TOKEN", "")
+        auth = self.headers.get("Authorization", "")
+        if token and not hmac.compare_digest(auth, f"Bearer {token}"):
+            self.send_response(401)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", "12")
+            self.send_header("WWW-Authenticate", "Bearer")
+            self.end_headers()
+            self.wfile.write(b"Unauthorized")
+            return
+
+        body = _metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
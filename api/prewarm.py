@@ -0,0 +1,38 @@
+import hmac
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler
+
+from api._http import send_text
+from api.calendar import prewarm
+
+# Seconds between cron runs; feeds going stale before the next run are
+# rebuilt now
+CRON_INTERVAL = int(os.environ.get("PREWARM_CRON_INTERVAL", "300"))
+# Stop starting rebuilds after this many seconds, within maxDuration
+TIME_BUDGET = 25
+
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # Vercel cron sends CRON_SECRET as a bearer token. Each pass can
+        # refetch every tracked team, so without a secret the endpoint is off.
+        secret = os.environ.get("CRON_SECRET", "")
+        if not secret:
+            send_text(self, 404, "Prewarming is not enabled: set CRON_SECRET")
+            return
+        auth = self.headers.get("Authorization", "")
+        if not hmac.compare_digest(auth, f"Bearer {secret}"):
+            send_text(self, 401, "Unauthorized")
+            return
+
+        results = prewarm(ahead=CRON_INTERVAL,
+                          deadline=time.time() + TIME_BUDGET)
+        body = json.dumps(results).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
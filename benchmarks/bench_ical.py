@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Compare the icalendar-based and fast ICS serializers.
+
+Checks that both paths produce the same bytes for a synthetic team, then
+times each one.
+
+    python benchmarks/bench_ical.py --events 500 --repeat 20
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from api._ical_generator import generate_ical  # noqa: E402
+
+
+def make_team(n_events):
+    """Build synthetic events, locations and opponents for one team."""
+    locations = {
+        i: {"id": i, "name": f"Field {i}, North",
+            "address": f"{i} Main St; Springfield"}
+        for i in range(1, 11)
+    }
+    opponents = {i: {"id": i, "name": f"Opponent {i}"} for i in range(1, 21)}
+    notes = {
+        0: ("Uniform: white jerseys\nBring water, snacks and "
+            "the équipement bag — see coach for details."),
+        # TeamSnap sends literal \n; long enough that folds land around them
+        1: ("Warm-up at 18:00\\nParking behind the gym\\nCarpool list: "
+            "see the team page\\nCall the coach if you'll be late"),
+    }
+    events = []
+    for i in range(n_events):
+        day = i % 28 + 1
+        events.append({
+            "id": 1000 + i,
+            "team_id": 42,
+            "name": f"Practice #{i}, bring gear; be early" if i % 3 else "",
+            "is_game": i % 2 == 0,
+            "opponent_id": i % 20 + 1 if i % 4 == 0 else None,
+            "location_id": i % 10 + 1,
+            "start_date": f"2026-03-{day:02d}T18:30:00Z",
+            "end_date": f"2026-03-{day:02d}T20:00:00Z",
+            "notes": notes.get(i % 5),
+            "is_canceled": i % 17 == 0,
+            "updated_at": "2026-02-01T12:00:00Z",
+        })
+    return events, locations, opponents
+
+
+def bench(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--tz", default="America/New_York")
+    args = parser.parse_args()
+
+    events, locations, opponents = make_team(args.events)
+
+    def run(fast):
+        return generate_ical(events, locations, opponents, team_name="Tigers",
+                             team_tz_name=args.tz, stable_dtstamp=True,
+                             fast=fast)
+
+    slow_out, fast_out = run(False), run(True)
+    if slow_out != fast_out:
+        print("FAIL: fast serializer output differs from icalendar output")
+        return 1
+
+    slow = bench(lambda: run(False), args.repeat)
+    fast = bench(lambda: run(True), args.repeat)
+    print(f"events:    {args.events} ({len(fast_out)} bytes)")
+    print(f"icalendar: {slow * 1000:8.2f} ms")
+    print(f"fast:      {fast * 1000:8.2f} ms")
+    print(f"speedup:   {slow / fast:8.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Check the shared cache backends in api/_cache_backend.py offline.
+
+Runs get/set/delete and expiry against MemoryBackend, SQLiteBackend (on a
+temporary file) and RedisBackend (against benchmarks/fake_redis.py), plus
+Redis AUTH, SELECT and reconnects and the parsing of CACHE_BACKEND_URL:
+
+    python benchmarks/check_backends.py
+
+Exits non-zero if any check fails.
+"""
+
+import os
+import socket
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from api._cache_backend import (  # noqa: E402
+    MemoryBackend, RedisBackend, SQLiteBackend, backend_from_url,
+)
+from fake_redis import FakeRedis, serve  # noqa: E402
+
+failures = []
+
+
+def check(name, condition):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}")
+    if not condition:
+        failures.append(name)
+
+
+def raises(fn, *args):
+    try:
+        fn(*args)
+    except Exception:
+        return True
+    return False
+
+
+def check_basics(name, backend):
+    value = b"BEGIN:VCALENDAR\r\n\x00\xff\r\nEND:VCALENDAR\r\n"
+    check(f"{name}: missing key", backend.get("missing") is None)
+    backend.set("feed:1", value, 60)
+    check(f"{name}: set then get", backend.get("feed:1") == value)
+    backend.set("feed:1", b"v2", 60)
+    check(f"{name}: overwrite", backend.get("feed:1") == b"v2")
+    backend.delete("feed:1")
+    check(f"{name}: delete", backend.get("feed:1") is None)
+    backend.delete("feed:1")
+    check(f"{name}: delete of a missing key", backend.get("feed:1") is None)
+    backend.set("short", b"x", 1)
+    backend.set("long", b"y", 60)
+
+
+def check_expiry(name, backend):
+    check(f"{name}: expired key", backend.get("short") is None)
+    check(f"{name}: unexpired key", backend.get("long") == b"y")
+
+
+def check_redis(fake, port):
+    url = f"redis://:secret@127.0.0.1:{port}/3"
+    backend = backend_from_url(url)
+    check("redis: URL parsed", (backend.host, backend.port, backend.db,
+                                backend.password) == ("127.0.0.1", port, 3,
+                                                      "secret"))
+    backend.set("k", b"db3", 60)
+    other = RedisBackend(port=port, host="127.0.0.1", password="secret")
+    check("redis: SELECT keeps databases apart", other.get("k") is None)
+    check("redis: SELECT reads its own database", backend.get("k") == b"db3")
+
+    check("redis: missing password is refused",
+          raises(RedisBackend(host="127.0.0.1", port=port).get, "k"))
+    wrong = RedisBackend(host="127.0.0.1", port=port, password="nope")
+    check("redis: wrong password is refused", raises(wrong.get, "k"))
+    check("redis: wrong password stays refused", raises(wrong.get, "k"))
+    bad_db = RedisBackend(host="127.0.0.1", port=port, db=99,
+                          password="secret")
+    check("redis: bad SELECT is refused", raises(bad_db.get, "k"))
+    check("redis: bad SELECT stays refused", raises(bad_db.get, "k"))
+
+    connections = fake.connections
+    fake.drop_connections()
+    time.sleep(0.1)
+    check("redis: reconnects after the server drops it",
+          backend.get("k") == b"db3" and fake.connections == connections + 1)
+
+    down = RedisBackend(host="127.0.0.1", port=_free_port(), timeout=0.5)
+    check("redis: server down raises", raises(down.get, "k"))
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def check_sqlite_urls(tmp):
+    path = os.path.join(tmp, "abs.db")
+    check("sqlite: absolute path URL",
+          backend_from_url(f"sqlite://{path}").path == path)
+    cwd = os.getcwd()
+    os.chdir(tmp)
+    try:
+        backend = backend_from_url("sqlite://relative.db")
+        backend.set("k", b"v", 60)
+        check("sqlite: relative path URL",
+              backend.path == "relative.db"
+              and os.path.exists(os.path.join(tmp, "relative.db")))
+    finally:
+        os.chdir(cwd)
+    check("sqlite: empty path is in memory",
+          backend_from_url("sqlite://").path == ":memory:")
+    check("unknown scheme is refused", raises(backend_from_url, "ftp://x"))
+
+
+def main():
+    fake = FakeRedis(password="secret")
+    server, port = serve(fake)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "cache.db")
+        backends = {
+            "memory": MemoryBackend(),
+            "sqlite": SQLiteBackend(db_path),
+            "redis": RedisBackend(host="127.0.0.1", port=port,
+                                  password="secret"),
+        }
+        for name, backend in backends.items():
+            check_basics(name, backend)
+        time.sleep(1.1)
+        for name, backend in backends.items():
+            check_expiry(name, backend)
+
+        backends["sqlite"].set("shared", b"s", 60)
+        check("sqlite: visible to another connection",
+              SQLiteBackend(db_path).get("shared") == b"s")
+        check_sqlite_urls(tmp)
+        check_redis(fake, port)
+    server.shutdown()
+
+    print(f"{len(failures)} failed" if failures else "all checks passed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Local stand-in for a Redis server, for checking RedisBackend offline.
+
+Speaks enough RESP2 for api/_cache_backend.py: PING, AUTH, SELECT, GET,
+SET (with EX) and DEL, with numbered databases, per-key expiry and an
+optional password:
+
+    python benchmarks/fake_redis.py --port 6390 --password secret
+
+then CACHE_BACKEND_URL=redis://:secret@127.0.0.1:6390/0. In-process,
+serve() starts one on a free port and FakeRedis.drop_connections() closes
+every client socket, to exercise reconnects.
+"""
+
+import argparse
+import socketserver
+import sys
+import threading
+import time
+from collections import Counter
+
+DATABASES = 16
+
+
+class FakeRedis:
+    """The keyspace, password and counters of one server."""
+
+    def __init__(self, password=None):
+        self.password = password
+        self.calls = Counter()
+        self.connections = 0
+        self._dbs = [{} for _ in range(DATABASES)]  # key -> (value, expires_at)
+        self._sockets = set()
+        self._lock = threading.Lock()
+
+    def get(self, db, key):
+        with self._lock:
+            item = self._dbs[db].get(key)
+            if item is None:
+                return None
+            if item[1] is not None and item[1] <= time.time():
+                del self._dbs[db][key]
+                return None
+            return item[0]
+
+    def set(self, db, key, value, ttl=None):
+        with self._lock:
+            self._dbs[db][key] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, db, key):
+        with self._lock:
+            return 1 if self._dbs[db].pop(key, None) is not None else 0
+
+    def connected(self, sock):
+        with self._lock:
+            self.connections += 1
+            self._sockets.add(sock)
+
+    def disconnected(self, sock):
+        with self._lock:
+            self._sockets.discard(sock)
+
+    def drop_connections(self):
+        """Close every client connection, as a server restart would."""
+        with self._lock:
+            sockets = list(self._sockets)
+        for sock in sockets:
+            try:
+                sock.shutdown(2)
+            except OSError:
+                pass
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        fake = self.server.fake
+        fake.connected(self.connection)
+        self.db = 0
+        self.authenticated = fake.password is None
+        try:
+            while True:
+                args = self._read_command()
+                if args is None:
+                    return
+                self.wfile.write(self._reply(fake, args))
+        except (OSError, ValueError):
+            pass
+        finally:
+            fake.disconnected(self.connection)
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            raise ValueError(f"Expected an array, got {line!r}")
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _reply(self, fake, args):
+        command = args[0].decode().upper()
+        fake.calls[command] += 1
+        if command == "PING":
+            return b"+PONG\r\n"
+        if command == "AUTH":
+            if fake.password is None:
+                return b"-ERR AUTH called without any password configured\r\n"
+            if args[-1].decode() != fake.password:
+                return b"-WRONGPASS invalid username-password pair\r\n"
+            self.authenticated = True
+            return b"+OK\r\n"
+        if not self.authenticated:
+            return b"-NOAUTH Authentication required.\r\n"
+        if command == "SELECT":
+            db = int(args[1])
+            if not 0 <= db < DATABASES:
+                return b"-ERR DB index is out of range\r\n"
+            self.db = db
+            return b"+OK\r\n"
+        if command == "GET":
+            value = fake.get(self.db, args[1])
+            if value is None:
+                return b"$-1\r\n"
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if command == "SET":
+            ttl = None
+            if len(args) == 5 and args[3].upper() == b"EX":
+                ttl = int(args[4])
+            fake.set(self.db, args[1], args[2], ttl)
+            return b"+OK\r\n"
+        if command == "DEL":
+            return b":%d\r\n" % sum(fake.delete(self.db, key) for key in args[1:])
+        return b"-ERR unknown command '%s'\r\n" % command.encode()
+
+
+def serve(fake, host="127.0.0.1", port=0):
+    """Start a threaded server for fake; returns (server, port)."""
+    server = socketserver.ThreadingTCPServer((host, port), FakeRedisHandler)
+    server.daemon_threads = True
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    parser.add_argument("--password")
+    args = parser.parse_args()
+
+    server, port = serve(FakeRedis(password=args.password), args.host,
+                         args.port)
+    print(f"Listening on redis://{args.host}:{port}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
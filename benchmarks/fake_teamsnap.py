@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""Local stand-in for the TeamSnap v3 API, for offline benchmarks.
+
+Serves synthetic teams as Collection+JSON on the endpoints TeamSnapClient
+uses (me, teams, members, events, availabilities, locations, opponents and
+oauth/token), with optional latency and error injection:
+
+    python benchmarks/fake_teamsnap.py --port 8090 --events 300 --members 25
+
+Point the app at it with
+
+    TEAMSNAP_BASE_URL=http://127.0.0.1:8090/v3
+    TEAMSNAP_TOKEN_URL=http://127.0.0.1:8090/oauth/token
+    TEAMSNAP_ACCESS_TOKEN=bench-token
+
+Teams 1..--teams exist. Member IDs are team_id * 1000 + n (n from 1) and the
+current user is member 1 of every team. GET /_stats returns the upstream
+call counts per endpoint and status; add ?reset=1 to zero them.
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+ACCESS_TOKEN = "bench-token"
+USER_ID = 1
+
+TIMEZONES = ["America/New_York", "Europe/London", "Asia/Hong_Kong",
+             "America/Los_Angeles", "UTC"]
+
+
+def _ts(dt):
+    return dt.strftime(TIMESTAMP_FORMAT)
+
+
+def make_team(team_id, n_events=200, n_members=20, n_locations=10,
+              n_opponents=20, seed=0):
+    """Build one synthetic team as lists of flat item dicts."""
+    rng = random.Random(seed * 7919 + team_id)
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    updated_at = _ts(now - timedelta(days=1))
+
+    team = {"id": team_id, "name": f"Team {team_id}",
+            "time_zone_iana_name": TIMEZONES[team_id % len(TIMEZONES)]}
+    members = [
+        {"id": team_id * 1000 + n, "first_name": f"Player{n}",
+         "last_name": f"Family{rng.randint(1, 99)}", "user_id":
+         USER_ID if n == 1 else None, "updated_at": updated_at}
+        for n in range(1, n_members + 1)
+    ]
+    locations = [
+        {"id": team_id * 100 + n, "name": f"Field {n}, North",
+         "address": f"{n} Main St; Springfield", "updated_at": updated_at}
+        for n in range(1, n_locations + 1)
+    ]
+    opponents = [
+        {"id": team_id * 100 + n, "name": f"Opponent {n}",
+         "updated_at": updated_at}
+        for n in range(1, n_opponents + 1)
+    ]
+
+    events = []
+    # Spread events from a few days ago to a few months ahead
+    start = now - timedelta(days=3)
+    for n in range(n_events):
+        begins = start + timedelta(hours=n * 13)
+        is_game = rng.random() < 0.4
+        events.append({
+            "id": team_id * 100000 + n,
+            "team_id": team_id,
+            "name": "" if is_game else f"Practice #{n}, bring gear; be early",
+            "is_game": is_game,
+            "opponent_id": rng.choice(opponents)["id"] if is_game else None,
+            "location_id": rng.choice(locations)["id"],
+            "notes": ("Uniform: white jerseys\nBring water and snacks"
+                      if rng.random() < 0.2 else None),
+            "is_canceled": rng.random() < 0.05,
+            "start_date": _ts(begins),
+            "end_date": _ts(begins + timedelta(minutes=90)),
+            "updated_at": updated_at,
+            "created_at": updated_at,
+        })
+
+    availabilities = []
+    for member in members:
+        for event in events:
+            # Mostly Yes, then No, Maybe and no answer
+            status = rng.choices([1, 0, 2, None], weights=[50, 25, 15, 10])[0]
+            availabilities.append({
+                "id": event["id"] * 1000 + member["id"] % 1000,
+                "member_id": member["id"],
+                "event_id": event["id"],
+                "status_code": status,
+            })
+
+    return {"team": team, "members": members, "events": events,
+            "locations": locations, "opponents": opponents,
+            "availabilities": availabilities}
+
+
+def _to_item(record):
+    return {"data": [{"name": k, "value": v} for k, v in record.items()]}
+
+
+class FakeTeamSnap:
+    """Synthetic TeamSnap data plus the knobs and counters of one server."""
+
+    def __init__(self, teams=3, n_events=200, n_members=20, latency=0.0,
+                 error_rate=0.0, token_ttl=7200, seed=0):
+        self.teams = teams
+        self.n_events = n_events
+        self.n_members = n_members
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.seed = seed
+        self.calls = Counter()
+        self._data = {}
+        self._tokens = {ACCESS_TOKEN: float("inf")}
+        self._issued = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def team(self, team_id):
+        """Return the synthetic data for team_id, or None if it doesn't exist."""
+        if not 1 <= team_id <= self.teams:
+            return None
+        with self._lock:
+            data = self._data.get(team_id)
+            if data is None:
+                data = make_team(team_id, self.n_events, self.n_members,
+                                 seed=self.seed)
+                self._data[team_id] = data
+            return data
+
+    def count(self, endpoint, status):
+        with self._lock:
+            self.calls[f"{endpoint} {status}"] += 1
+
+    def stats(self, reset=False):
+        with self._lock:
+            calls = dict(self.calls)
+            if reset:
+                self.calls.clear()
+        return calls
+
+    def should_fail(self):
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+    def issue_token(self):
+        with self._lock:
+            self._issued += 1
+            token = f"{ACCESS_TOKEN}-{self._issued}"
+            self._tokens[token] = time.time() + self.token_ttl
+        return token
+
+    def token_valid(self, token):
+        with self._lock:
+            return self._tokens.get(token, 0) > time.time()
+
+    def search(self, resource, params):
+        """Return the items of resource matching the search params."""
+        try:
+            team_id = int(params.get("team_id", "0"))
+        except ValueError:
+            return []
+        data = self.team(team_id)
+        if data is None:
+            return []
+        items = data[resource]
+
+        if resource == "members" and "user_id" in params:
+            user_id = int(params["user_id"])
+            items = [m for m in items if m["user_id"] == user_id]
+        if resource == "availabilities" and "member_id" in params:
+            wanted = {int(m) for m in params["member_id"].split(",")}
+            items = [a for a in items if a["member_id"] in wanted]
+        if resource == "events" and "started_after" in params:
+            items = [e for e in items if e["start_date"] >= params["started_after"]]
+        if "updated_since" in params:
+            since = params["updated_since"]
+            items = [i for i in items if (i.get("updated_at") or "") >= since]
+        return items
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real API, so the client's pooled sessions matter
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = parse_qs(self.rfile.read(length).decode())
+        if parsed.path != "/oauth/token":
+            self._send_json(404, {"error": "not_found"}, "unknown")
+            return
+        if body.get("grant_type") != ["refresh_token"]:
+            self._send_json(400, {"error": "invalid_grant"}, "token")
+            return
+        self._send_json(200, {
+            "access_token": self.fake.issue_token(),
+            "refresh_token": f"refresh-{time.time_ns()}",
+            "expires_in": self.fake.token_ttl,
+        }, "token")
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+
+        if parsed.path == "/_stats":
+            self._send_json(200, self.fake.stats(reset="reset" in params), None)
+            return
+
+        path = parsed.path.removeprefix("/v3")
+        endpoint = path.split("/")[1] if "/" in path else path
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        if self.fake.should_fail():
+            self._send_json(503, {"error": "unavailable"}, endpoint)
+            return
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not self.fake.token_valid(token):
+            self._send_json(401, {"error": "invalid_token"}, endpoint)
+            return
+
+        if path == "/me":
+            items = [{"id": USER_ID}]
+        elif path.startswith("/teams/"):
+            try:
+                data = self.fake.team(int(path.rsplit("/", 1)[1]))
+            except ValueError:
+                data = None
+            if data is None:
+                self._send_json(404, {"error": "not_found"}, endpoint)
+                return
+            items = [data["team"]]
+        elif path.endswith("/search") and endpoint in (
+                "members", "events", "availabilities", "locations", "opponents"):
+            items = self.fake.search(endpoint, params)
+        else:
+            self._send_json(404, {"error": "not_found"}, endpoint)
+            return
+
+        collection = {}
+        if "page_size" in params:
+            page_size = int(params["page_size"])
+            page_number = int(params.get("page_number", "1"))
+            first = (page_number - 1) * page_size
+            if first + page_size < len(items):
+                query = dict(params, page_number=page_number + 1)
+                collection["links"] = [{
+                    "rel": "next",
+                    "href": f"http://{self.headers['Host']}{parsed.path}?"
+                            + urlencode(query),
+                }]
+            items = items[first:first + page_size]
+        collection["items"] = [_to_item(i) for i in items]
+        self._send_json(200, {"collection": collection}, endpoint)
+
+    def _send_json(self, status, payload, endpoint):
+        if endpoint is not None:
+            self.fake.count(endpoint, status)
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(fake, host="127.0.0.1", port=0):
+    """Start a threaded server for fake; returns (server, base URL)."""
+    server = ThreadingHTTPServer((host, port), FakeHandler)
+    server.daemon_threads = True
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--teams", type=int, default=3)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every API request")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of API requests answered with 503")
+    parser.add_argument("--token-ttl", type=int, default=7200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeTeamSnap(teams=args.teams, n_events=args.events,
+                        n_members=args.members, latency=args.latency,
+                        error_rate=args.error_rate, token_ttl=args.token_ttl,
+                        seed=args.seed)
+    server, url = serve(fake, args.host, args.port)
+    # run.py reads this line to find the port
+    print(f"Listening on {url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
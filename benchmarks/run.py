@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""Offline feed benchmarks against the local TeamSnap stand-in.
+
+Starts benchmarks/fake_teamsnap.py in a subprocess, points the app at it
+and runs each scenario, reporting latency percentiles, throughput,
+upstream calls and peak Python memory:
+
+    python benchmarks/run.py --events 300 --members 25 --latency 0.05
+    python benchmarks/run.py --scenario calendar_http --concurrency 16
+
+Scenarios:
+    ical           generate_ical (icalendar) on one team's events
+    ical_fast      the same with the fast RFC 5545 writer
+    build_cold     _build_feed with every cache cleared before each build
+    build_warm     _build_feed with team data and availabilities cached
+    calendar_http  GET /api/calendar through the handler, caches cold at start
+    feeds_http     GET /api/feeds for pairs of teams
+    members_http   GET /api/members through the handler
+
+Peak memory is measured in a second, sequential pass under tracemalloc so
+its overhead doesn't skew the timings; --no-memory skips it.
+
+Before the scenarios, the api/ modules are imported in a fresh interpreter
+to check the cold-start import time against --import-budget and that
+icalendar and requests are only loaded once a feed is built.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+from urllib.request import urlopen
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+# Heavy dependencies that must not load at import time
+LAZY_MODULES = ("icalendar", "requests")
+
+SCENARIOS = ["ical", "ical_fast", "build_cold", "build_warm", "calendar_http",
+             "feeds_http", "members_http"]
+
+
+def start_fake(args):
+    """Run the stand-in server in its own process; returns (process, URL)."""
+    cmd = [sys.executable, os.path.join(ROOT, "benchmarks", "fake_teamsnap.py"),
+           "--port", "0", "--teams", str(args.teams),
+           "--events", str(args.events), "--members", str(args.members),
+           "--latency", str(args.latency), "--error-rate", str(args.error_rate),
+           "--seed", str(args.seed)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    if not line.startswith("Listening on "):
+        proc.kill()
+        raise RuntimeError("Fake TeamSnap server did not start")
+    return proc, line.split()[-1]
+
+
+def check_imports(budget_ms, runs=5):
+    """Time a cold import of the handlers in fresh interpreters.
+
+    Returns (best time in ms, eagerly loaded LAZY_MODULES, within budget).
+    """
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import api.calendar, api.feeds, api.members, api.metrics, api.prewarm\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"loaded = [m for m in {LAZY_MODULES!r} if m in sys.modules]\n"
+        "print(elapsed * 1000, ','.join(loaded))\n"
+    )
+    best = float("inf")
+    loaded = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True,
+                             capture_output=True, text=True).stdout.split()
+        best = min(best, float(out[0]))
+        loaded = out[1].split(",") if len(out) > 1 else []
+    return best, loaded, best <= budget_ms and not loaded
+
+
+def upstream_calls(fake_url, reset=True):
+    with urlopen(f"{fake_url}/_stats?reset=1" if reset
+                 else f"{fake_url}/_stats") as resp:
+        return json.load(resp)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(round(q * (len(sorted_values) - 1))))]
+
+
+def reset_caches():
+    from api import calendar, members
+
+    for cache in (calendar._cache, calendar._team_cache, calendar._avail_cache,
+                  calendar._snapshots, members._page_cache):
+        cache.clear()
+
+
+def serve_handler(handler_cls):
+    """Serve an api/ handler in this process; returns (server, port)."""
+    quiet = type(handler_cls.__name__, (handler_cls,),
+                 {"log_message": lambda self, format, *args: None})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), quiet)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_port
+
+
+def http_get(port, path, encoding):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        conn.request("GET", path,
+                     headers={"Accept-Encoding": encoding} if encoding else {})
+        resp = conn.getresponse()
+        body = resp.read()
+        if resp.status != 200:
+            raise RuntimeError(f"GET {path}: {resp.status} {body[:200]!r}")
+        return body
+    finally:
+        conn.close()
+
+
+def make_scenario(name, args):
+    """Return (setup, op, calls, concurrency) for a scenario.
+
+    setup() runs before each pass; op(*call) is timed once per entry in
+    calls, on up to concurrency threads.
+    """
+    from api._ical_generator import generate_ical
+    from api.calendar import _build_feed
+    from api.calendar import handler as calendar_handler
+    from api.feeds import handler as feeds_handler
+    from api.members import handler as members_handler
+
+    from fake_teamsnap import make_team
+
+    teams = range(1, args.teams + 1)
+    member_ids = [t * 1000 + n for t in teams
+                  for n in range(1, args.members + 1)]
+    # Interleave teams, so concurrent requests overlap on team data
+    member_ids.sort(key=lambda m: (m % 1000, m))
+    feed_calls = [(m // 1000, m) for m in member_ids][:args.requests]
+
+    if name in ("ical", "ical_fast"):
+        team = make_team(1, args.events, args.members, seed=args.seed)
+        locations = {loc["id"]: loc for loc in team["locations"]}
+        opponents = {opp["id"]: opp for opp in team["opponents"]}
+        tz = team["team"]["time_zone_iana_name"]
+
+        def op():
+            return generate_ical(team["events"], locations, opponents,
+                                 team_name=team["team"]["name"],
+                                 team_tz_name=tz, stable_dtstamp=True,
+                                 fast=name == "ical_fast")
+        return (lambda: None), op, [()] * args.requests, args.concurrency
+
+    if name == "build_cold":
+        def op(team_id, member_id):
+            reset_caches()
+            return _build_feed(team_id, member_id)
+        # One at a time, or builds would clear each other's caches
+        return reset_caches, op, feed_calls[:max(1, args.requests // 4)], 1
+
+    if name == "build_warm":
+        def setup():
+            reset_caches()
+            for team_id in teams:
+                _build_feed(team_id, team_id * 1000 + 1)
+        return setup, _build_feed, feed_calls, args.concurrency
+
+    handlers = {"calendar_http": calendar_handler,
+                "feeds_http": feeds_handler,
+                "members_http": members_handler}
+    _, port = serve_handler(handlers[name])
+    if name == "calendar_http":
+        paths = [f"/api/calendar?team_id={t}&member_id={m}"
+                 for t, m in feed_calls]
+    elif name == "feeds_http":
+        paths = [f"/api/feeds?feed={t}:{m}&feed={t % args.teams + 1}:"
+                 f"{(t % args.teams + 1) * 1000 + m % 1000}"
+                 for t, m in feed_calls]
+    else:
+        paths = [f"/api/members?team_id={t % args.teams + 1}"
+                 for t in range(args.requests)]
+    return (reset_caches, (lambda path: http_get(port, path, args.encoding)),
+            [(path,) for path in paths], args.concurrency)
+
+
+def run_scenario(name, args, fake_url):
+    setup, op, calls, concurrency = make_scenario(name, args)
+
+    setup()
+    upstream_calls(fake_url)
+    latencies = []
+    errors = 0
+
+    def timed(call):
+        start = time.perf_counter()
+        op(*call)
+        return time.perf_counter() - start
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(timed, call) for call in calls]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception as e:
+                errors += 1
+                if errors == 1:
+                    print(f"  {name}: {e}", file=sys.stderr)
+    wall = time.perf_counter() - started
+    calls_made = upstream_calls(fake_url)
+
+    peak = None
+    if not args.no_memory:
+        setup()
+        tracemalloc.start()
+        for call in calls:
+            try:
+                op(*call)
+            except Exception:
+                pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        upstream_calls(fake_url)
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": len(calls),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "req_per_s": len(latencies) / wall if wall else 0.0,
+        "upstream_calls": sum(calls_made.values()),
+        "upstream": calls_made,
+        "peak_mb": peak / 1e6 if peak is not None else None,
+    }
+
+
+def print_report(results):
+    print(f"{'scenario':<15}{'reqs':>6}{'errs':>6}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'req/s':>10}{'upstream':>10}{'peak MB':>9}")
+    for r in results:
+        peak = f"{r['peak_mb']:9.1f}" if r["peak_mb"] is not None else f"{'-':>9}"
+        print(f"{r['scenario']:<15}{r['requests']:>6}{r['errors']:>6}"
+              f"{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['req_per_s']:>10.1f}"
+              f"{r['upstream_calls']:>10}{peak}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="run only this scenario (repeatable)")
+    parser.add_argument("--teams", type=int, default=3)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every upstream request")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of upstream requests failing with 503")
+    parser.add_argument("--requests", type=int, default=40,
+                        help="timed operations per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--encoding", default="gzip",
+                        help="Accept-Encoding sent by the HTTP scenarios"
+                             " ('' for none)")
+    parser.add_argument("--import-budget", type=float, default=150.0,
+                        help="max cold import time of the handlers, in ms")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the tracemalloc pass")
+    parser.add_argument("--json", metavar="PATH",
+                        help="also write the results to PATH as JSON")
+    args = parser.parse_args()
+
+    import_ms, eager, imports_ok = check_imports(args.import_budget)
+    print(f"cold import: {import_ms:.1f} ms (budget {args.import_budget:.0f} ms)"
+          + (f", eagerly loads {', '.join(eager)}" if eager else ""))
+
+    proc, fake_url = start_fake(args)
+    try:
+        # Must be set before the api modules are imported
+        os.environ.update({
+            "TEAMSNAP_BASE_URL": f"{fake_url}/v3",
+            "TEAMSNAP_TOKEN_URL": f"{fake_url}/oauth/token",
+            "TEAMSNAP_ACCESS_TOKEN": "bench-token",
+            "TEAMSNAP_REFRESH_TOKEN": "bench-refresh",
+            "TEAMSNAP_CLIENT_ID": "bench",
+            "TEAMSNAP_CLIENT_SECRET": "bench",
+        })
+        # Measure this process's caches only
+        os.environ.pop("CACHE_BACKEND_URL", None)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+        results = [run_scenario(name, args, fake_url)
+                   for name in args.scenario or SCENARIOS]
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if not imports_ok:
+        print("FAIL: cold import is over budget or loads heavy modules eagerly")
+        return 1
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,27 @@
 #!/usr/bin/env python3
-"""Local test server for the calendar feed."""
+"""Local (or self-hosted) server for every endpoint in api/.
 
+Each api/<name>.py handler is served at /api/<name>, from one process, so
+all requests share the same feed caches and TeamSnap connection pool.
+Connections are handled on a fixed pool of worker threads with HTTP/1.1
+keep-alive; a slow TeamSnap fetch for one team only ties up its own
+worker. A background thread rebuilds recently requested feeds before they
+go stale (see api/_prewarm.py).
+
+    python serve_local.py --port 3000 --workers 16
+"""
+
+import argparse
+import importlib
+import logging
 import os
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import parse_qs, urlparse
+import pkgutil
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse
 
 # Load .env file
 env_path = os.path.join(os.path.dirname(__file__), ".env")
@@ -15,54 +33,126 @@ if os.path.exists(env_path):
                 key, value = line.split("=", 1)
                 os.environ.setdefault(key.strip(), value.strip())
 
-from api._teamsnap_client import TeamSnapClient
-from api._ical_generator import generate_ical
-from api.calendar import _build_feed, _get_cached, _set_cached
+import api  # noqa: E402
+from api._http import send_text  # noqa: E402
+from api.calendar import prewarm  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.environ.get("SERVER_WORKERS", "16"))
+# Idle keep-alive connections are closed after this many seconds, so they
+# don't hold on to workers
+KEEPALIVE_TIMEOUT = float(os.environ.get("SERVER_KEEPALIVE_TIMEOUT", "5"))
+# Seconds between prewarm passes; must stay below calendar.PREWARM_AHEAD
+PREWARM_INTERVAL = float(os.environ.get("PREWARM_INTERVAL", "30"))
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that handles each connection on a fixed pool of threads."""
+
+    request_queue_size = 128
+
+    def __init__(self, address, handler_class, workers=WORKERS):
+        super().__init__(address, handler_class)
+        self.pool = ThreadPoolExecutor(max_workers=workers,
+                                       thread_name_prefix="http")
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
 
+class _Routed:
+    """Dispatches each request on a connection to its api/ handler.
 
-class Handler(BaseHTTPRequestHandler):
+    Once a request line is parsed, the instance switches to the handler
+    class for its path; the api/ handlers all share BaseHTTPRequestHandler's
+    layout, so one connection can serve requests for different endpoints.
+    """
+
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out in separate writes; don't let Nagle hold the
+    # body back on a kept-alive connection
+    disable_nagle_algorithm = True
+    routes = {}
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        path = urlparse(self.path).path.rstrip("/")
+        self.__class__ = self.routes.get(path, NotFound)
+        return True
+
+
+class NotFound(_Routed, BaseHTTPRequestHandler):
     def do_GET(self):
-        parsed = urlparse(self.path)
-
-        if parsed.path not in ("/api/calendar", "/api/calendar/"):
-            self.send_response(404)
-            self.send_header("Content-Type", "text/plain")
-            self.end_headers()
-            self.wfile.write(b"Not found. Use /api/calendar?team_id=YOUR_TEAM_ID")
-            return
-
-        params = parse_qs(parsed.query)
-        team_id = params.get("team_id", [None])[0]
-
-        if not team_id:
-            self.send_response(400)
-            self.send_header("Content-Type", "text/plain")
-            self.end_headers()
-            self.wfile.write(b"Missing required query parameter: team_id")
-            return
-
-        ical_data = _get_cached(team_id)
-        if not ical_data:
-            try:
-                ical_data = _build_feed(team_id)
-                _set_cached(team_id, ical_data)
-            except Exception as e:
-                self.send_response(500)
-                self.send_header("Content-Type", "text/plain")
-                self.end_headers()
-                self.wfile.write(f"Error: {e}".encode())
-                return
-
-        self.send_response(200)
-        self.send_header("Content-Type", "text/calendar; charset=utf-8")
-        self.send_header("Cache-Control", "public, max-age=300")
-        self.end_headers()
-        self.wfile.write(ical_data)
+        routes = ", ".join(sorted(self.routes))
+        send_text(self, 404, f"Not found. Endpoints: {routes}")
+
+
+def load_routes():
+    """Map /api/<name> to a _Routed subclass of each api/<name>.handler."""
+    routes = {}
+    for module in pkgutil.iter_modules(api.__path__):
+        if module.name.startswith("_"):
+            continue
+        handler = importlib.import_module(f"api.{module.name}").handler
+        routes[f"/api/{module.name}"] = type(
+            handler.__name__, (_Routed, handler), {})
+    _Routed.routes = routes
+    return routes
+
+
+def prewarm_forever(interval):
+    while True:
+        # Jittered, so servers sharing a cache backend drift out of step
+        time.sleep(interval * random.uniform(0.8, 1.2))
+        try:
+            prewarm()
+        except Exception:
+            logger.exception("Prewarm pass failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="")
+    parser.add_argument("--port", type=int,
+                        default=int(os.environ.get("PORT", "3000")))
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="connections handled at once (default %(default)s)")
+    parser.add_argument("--prewarm-interval", type=float,
+                        default=PREWARM_INTERVAL,
+                        help="seconds between prewarm passes, 0 to disable")
+    args = parser.parse_args()
+
+    routes = load_routes()
+    server = PooledHTTPServer((args.host, args.port), NotFound,
+                              workers=args.workers)
+    print(f"Serving on http://localhost:{args.port} with {args.workers} workers")
+    for path in sorted(routes):
+        print(f"  {path}")
+    if args.prewarm_interval > 0:
+        threading.Thread(target=prewarm_forever, args=(args.prewarm_interval,),
+                         daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
 
 if __name__ == "__main__":
-    port = 3000
-    server = HTTPServer(("", port), Handler)
-    print(f"Serving on http://localhost:{port}")
-    print(f"Test: curl http://localhost:{port}/api/calendar?team_id=YOUR_TEAM_ID")
-    server.serve_forever()
+    main()